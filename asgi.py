@@ -0,0 +1,335 @@
+import asyncio
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs, quote, urlencode
+from peewee import DoesNotExist
+import report_racers
+from metrics import registry
+from renders import RENDERS
+from snapshots import MAX_URL_ROOTS, ORDERS
+
+DB_THREADS = 4
+RACER_PATH = re.compile(r'/api/v1/report/drivers/(?P<name>[^/]+)/')
+LAPS_PATH = re.compile(r'/api/v1/report/drivers/(?P<name>[^/]+)/laps/')
+TEAM_PATH = re.compile(r'/api/v1/report/teams/(?P<team>[^/]+)/')
+
+
+class HTTPError(Exception):
+    """An error response with a flask_restful-like {"message": ...} body."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class AsyncReport:
+    """
+    Awaitable versions of the report_racers queries.
+
+    Peewee is synchronous, so every query runs in a dedicated pool of max_workers
+    threads, each with its own connection to the database; the event loop only
+    waits for the result.
+
+    Args:
+        max_workers (int): The number of database threads.
+    """
+
+    def __init__(self, max_workers=DB_THREADS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='report-db')
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    async def get_generation(self):
+        return await self._run(report_racers.get_generation)
+
+    async def get_all_racer(self, order, session=None):
+        return await self._run(report_racers.get_all_racer, order, session)
+
+    async def get_racer_page(self, order, limit, after=None, session=None):
+        return await self._run(report_racers.get_racer_page, order, limit, after, session)
+
+    async def get_racer_by_code(self, name, session=None):
+        return await self._run(report_racers.get_racer_by_code, name, session)
+
+    async def get_laps(self, name, session=None):
+        return await self._run(report_racers.get_laps, name, session)
+
+    async def get_teams(self, session=None):
+        return await self._run(report_racers.get_teams, session)
+
+    async def get_team(self, team, session=None):
+        return await self._run(report_racers.get_team, team, session)
+
+    async def get_sessions(self):
+        return await self._run(report_racers.get_sessions)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class ReportApp:
+    """
+    The ASGI application.
+
+    Serves GET and HEAD requests of the same resources and query parameters as the
+    Flask API: /api/v1/report/, /api/v1/report/drivers/,
+    /api/v1/report/drivers/<name>/, /api/v1/report/drivers/<name>/laps/,
+    /api/v1/report/teams/, /api/v1/report/teams/<team>/ and /api/v1/sessions/. The bodies are rendered by
+    the renderers of renders.py and sent with a strong ETag (304 when it matches
+    If-None-Match). Lists are rendered as a whole, so 'stream' is accepted but has no
+    effect.
+
+    The Flask application holds a worker thread for every request until the client
+    has read the whole response. This application keeps slow clients on the event
+    loop instead: only the database queries run in threads (see AsyncReport), and the
+    bodies and the session ids are cached for the data generation, so most requests
+    reach the database only for the generation check. The driver list bodies contain
+    absolute links built from the Host header; like snapshots.SnapshotStore, they are
+    kept for the MAX_URL_ROOTS most recently used base URLs only. Run it with any ASGI
+    server next to the Flask application, e.g. `uvicorn asgi:app --port 8000`.
+
+    Args:
+        report (AsyncReport, optional): The database access layer.
+    """
+
+    def __init__(self, report=None):
+        self.report = report or AsyncReport()
+        self._generation = None
+        self._bodies = {}
+        self._links = OrderedDict()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        headers = {key.decode('latin-1').lower(): value.decode('latin-1')
+                   for key, value in scope.get('headers', [])}
+        try:
+            if scope['method'] not in ('GET', 'HEAD'):
+                raise HTTPError(405, "The method is not allowed for the requested URL.")
+            body, mimetype, extra_headers = await self.handle(scope, headers)
+        except HTTPError as e:
+            body, mimetype, extra_headers = self._error(e)
+            status = e.status
+        else:
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            extra_headers = [('etag', etag), ('cache-control', 'no-cache')] + extra_headers
+            status = 200
+            if etag in (tag.strip() for tag in headers.get('if-none-match', '').split(',')):
+                status, body = 304, b''
+        response_headers = [(b'content-type', mimetype.encode()),
+                            (b'content-length', str(len(body)).encode())]
+        response_headers += [(key.encode(), value.encode()) for key, value in extra_headers]
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body',
+                    'body': b'' if scope['method'] == 'HEAD' else body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.report.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    def _error(error):
+        return (json.dumps({'message': error.message}).encode('utf-8') + b'\n',
+                'application/json', [])
+
+    @staticmethod
+    def _base_url(scope, headers):
+        host = headers.get('host')
+        if not host:
+            server = scope.get('server') or ('localhost', None)
+            host = server[0] if server[1] in (None, 80, 443) else f'{server[0]}:{server[1]}'
+        return f"{scope.get('scheme', 'http')}://{host}{scope.get('root_path', '')}"
+
+    async def _cached(self, key, producer, base_url=None):
+        """
+        Return the value cached under key for the current data generation, see report_cache.cached.
+
+        Args:
+            key (tuple): The cache key.
+            producer (coroutine function): Produces the value, None is not cached.
+            base_url (str, optional): The base URL the value links to; such values are
+                                      cached for the MAX_URL_ROOTS most recent base URLs.
+        """
+        generation = await self.report.get_generation()
+        if generation != self._generation:
+            self._bodies = {}
+            self._links.clear()
+            self._generation = generation
+        if base_url is None:
+            bodies = self._bodies
+        else:
+            bodies = self._links.get(base_url)
+            if bodies is None:
+                bodies = self._links[base_url] = {}
+                while len(self._links) > MAX_URL_ROOTS:
+                    self._links.popitem(last=False)
+            else:
+                self._links.move_to_end(base_url)
+        body = bodies.get(key)
+        registry.record_cache('asgi', body is not None)
+        if body is None:
+            body = await producer()
+            if body is not None:
+                bodies[key] = body
+        return body
+
+    async def _get_session(self, args):
+        session = args.get('session')
+        if session is None:
+            return None
+        try:
+            session = int(session)
+        except ValueError:
+            raise HTTPError(400, "Invalid session parameter. Use the id of a session.")
+
+        async def produce_ids():
+            return frozenset(item['id'] for item in await self.report.get_sessions())
+
+        if session not in await self._cached(('session ids',), produce_ids):
+            raise HTTPError(404, "The requested session does not exist.")
+        return session
+
+    async def handle(self, scope, headers):
+        """
+        Render the body of one request.
+
+        Returns:
+            tuple: (body, mimetype, extra headers).
+
+        Raises:
+            HTTPError: For unknown paths and invalid parameters, like the Flask API.
+        """
+        path = scope['path']
+        args = {key: values[0] for key, values in
+                parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        if path == '/api/v1/sessions/':
+            async def produce_sessions():
+                return RENDERS['json']().dumps(await self.report.get_sessions())
+
+            return await self._cached(('sessions',), produce_sessions), 'application/json', []
+        laps = LAPS_PATH.fullmatch(path)
+        if laps:
+            return await self._laps(laps.group('name'), args), 'application/json', []
+        team = TEAM_PATH.fullmatch(path)
+        if path == '/api/v1/report/teams/' or team:
+            body = await self._teams(team.group('team') if team else None, args)
+            return body, 'application/json', []
+        racer = RACER_PATH.fullmatch(path)
+        if path not in ('/api/v1/report/', '/api/v1/report/drivers/') and not racer:
+            raise HTTPError(404, "The requested URL was not found on the server.")
+
+        format_name = args.get('format', 'json')
+        render_class = RENDERS.get(format_name)
+        if render_class is None:
+            raise HTTPError(500, f"Format does not support. Support formats are {set(RENDERS)}")
+        render_ = render_class()
+        session = await self._get_session(args)
+        base_url = self._base_url(scope, headers)
+
+        def driver_link(item):
+            query = f'?{urlencode({"session": session})}' if session is not None else ''
+            return dict(item, code=f"{base_url}/api/v1/report/drivers/{quote(item['code'])}/{query}")
+
+        if racer:
+            name = racer.group('name')
+
+            async def produce_racer():
+                try:
+                    return render_.dumps(await self.report.get_racer_by_code(name, session))
+                except DoesNotExist:
+                    return None
+
+            body = await self._cached(('racer', name, format_name, session), produce_racer)
+            if body is None:
+                raise HTTPError(404, "The requested URL was not found on the server.")
+            return body, render_.mimetype, []
+
+        order = args.get('order', 'asc')
+        if order not in ORDERS:
+            raise HTTPError(400, "Invalid order parameter. Use 'asc' or 'desc'.")
+        transform = driver_link if path == '/api/v1/report/drivers/' else None
+        if 'limit' in args or 'after' in args:
+            return await self._page(path, args, order, format_name, render_, session,
+                                    transform, base_url)
+
+        async def produce_list():
+            data = await self.report.get_all_racer(order, session)
+            return render_.dumps([transform(item) for item in data] if transform else data)
+
+        # Только список гонщиков содержит ссылки, зависящие от Host
+        body = await self._cached((path, order, format_name, session), produce_list,
+                                  base_url if transform else None)
+        return body, render_.mimetype, []
+
+    async def _laps(self, name, args):
+        """Render the laps of a driver as JSON, see main.LapsApi."""
+        session = await self._get_session(args)
+
+        async def produce_laps():
+            try:
+                return RENDERS['json']().dumps(await self.report.get_laps(name, session))
+            except DoesNotExist:
+                return None
+
+        body = await self._cached(('laps', name, session), produce_laps)
+        if body is None:
+            raise HTTPError(404, "The requested URL was not found on the server.")
+        return body
+
+    async def _teams(self, team, args):
+        """Render the aggregates of all teams, or of one team with its racers, see main.TeamsApi."""
+        session = await self._get_session(args)
+
+        async def produce_teams():
+            if team is None:
+                return RENDERS['json']().dumps(await self.report.get_teams(session))
+            try:
+                return RENDERS['json']().dumps(await self.report.get_team(team, session))
+            except DoesNotExist:
+                return None
+
+        body = await self._cached(('teams', team, session), produce_teams)
+        if body is None:
+            raise HTTPError(404, "The requested URL was not found on the server.")
+        return body
+
+    async def _page(self, path, args, order, format_name, render_, session, transform, base_url):
+        """Render one page of a list, see main.RenderMixin.render_page."""
+        try:
+            limit = int(args.get('limit', report_racers.MAX_PAGE_SIZE))
+            after = args.get('after')
+            cursor = report_racers.parse_cursor(after) if after else None
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        if not 0 < limit <= report_racers.MAX_PAGE_SIZE:
+            raise HTTPError(400, f"limit must be between 1 and {report_racers.MAX_PAGE_SIZE}")
+        racers, next_cursor = await self.report.get_racer_page(order, limit, cursor, session)
+        if transform:
+            racers = [transform(item) for item in racers]
+        extra_headers = []
+        if next_cursor:
+            query = {'order': order, 'format': format_name, 'limit': limit, 'after': next_cursor}
+            if session is not None:
+                query['session'] = session
+            extra_headers.append(('link', f'<{base_url}{path}?{urlencode(query)}>; rel="next"'))
+        return render_.dumps(racers), render_.mimetype, extra_headers
+
+
+app = ReportApp()
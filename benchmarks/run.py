@@ -0,0 +1,158 @@
+"""
+Time the import, the result recomputation and the report routes on synthetic data.
+
+Run from the project folder:
+
+    python benchmarks/run.py [--sizes 100x1,1000x1,1000x10] [--repeat 5] [--output results.json]
+    python benchmarks/run.py --baseline results.json [--threshold 1.25] [--noise-ms 0.5]
+
+Every size is DRIVERSxLAPS (see synthetic.generate_data). The results are written as
+JSON; with --baseline the timings are compared with a stored run and the exit status
+is 1 when one of them is slower than the baseline by more than the threshold.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import report_cache  # noqa: E402
+import report_racers  # noqa: E402
+import snapshots  # noqa: E402
+from main import create_app  # noqa: E402
+from synthetic import generate_data  # noqa: E402
+
+ROUTES = (
+    '/report',
+    '/report/drivers/',
+    '/report/drivers/{code}',
+    '/api/v1/report/',
+    '/api/v1/report/?order=desc&format=xml',
+    '/api/v1/report/?format=ndjson',
+    '/api/v1/report/?limit=50',
+    '/api/v1/report/drivers/',
+    '/api/v1/report/drivers/{code}/',
+    '/api/v1/report/drivers/{code}/laps/',
+    '/api/v1/report/teams/',
+)
+
+
+def measure(func, repeat, setup=None):
+    """Run func repeat times, return the min and median wall time in milliseconds (setup is not timed)."""
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {'min_ms': round(min(timings), 3), 'median_ms': round(statistics.median(timings), 3)}
+
+
+def reset_caches():
+    """Start a new data generation and drop the cached and pre-rendered responses."""
+    report_racers.bump_generation()
+    report_cache.cache.clear()
+    snapshots.store.clear()
+
+
+def run_size(drivers, laps, repeat, workdir):
+    """
+    Benchmark one data size in a fresh SQLite database.
+
+    Returns:
+        dict: Timings of 'import', 'recompute' and, for every route, of a request
+              after a data change ('cold') and of a repeated request ('warm').
+    """
+    folder = generate_data(workdir / f'data-{drivers}x{laps}', drivers, laps)
+    database = db.make_database(str(workdir / f'bench-{drivers}x{laps}.db'))
+    database.bind(db.MODELS, bind_refs=False, bind_backrefs=False)
+    migrations.migrate_database()
+
+    def empty_database():
+        # Каждый замер импорта начинается с пустой базы
+        for model in reversed(db.MODELS):
+            model.delete().execute()
+
+    results = {'import': measure(lambda: report_racers.store_data_from_files_to_db(folder),
+                                 repeat, setup=empty_database),
+               'recompute': measure(report_racers.result_update, repeat)}
+    code = report_racers.get_all_racer('asc')[0]['code']
+    client = create_app({'TESTING': True}).test_client()
+    for route in ROUTES:
+        url = route.format(code=code)
+
+        def request():
+            client.get(url).close()
+
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} answered {response.status_code}")
+        results[f'GET {route} cold'] = measure(request, repeat, setup=reset_caches)
+        results[f'GET {route} warm'] = measure(request, repeat)
+    database.close()
+    return results
+
+
+def compare(results, baseline, threshold, noise_ms=0.5):
+    """
+    Print the ratio of every timing to the baseline.
+
+    Returns:
+        list: The (size, name, ratio) of the timings slower than threshold times the
+              baseline and by more than noise_ms milliseconds.
+    """
+    regressions = []
+    for size, timings in results['sizes'].items():
+        for name, timing in timings.items():
+            base = baseline.get('sizes', {}).get(size, {}).get(name)
+            if not base:
+                continue
+            ratio = timing['min_ms'] / base['min_ms'] if base['min_ms'] else 1.0
+            regression = ratio > threshold and timing['min_ms'] - base['min_ms'] > noise_ms
+            mark = '  REGRESSION' if regression else ''
+            print(f"{size:>10} {name:<50} {base['min_ms']:>10.2f} -> {timing['min_ms']:>10.2f} ms"
+                  f" x{ratio:.2f}{mark}")
+            if regression:
+                regressions.append((size, name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='100x1,1000x1,1000x10',
+                        help='Comma separated DRIVERSxLAPS data sizes.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', type=Path, help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', type=Path, help='Compare with the results of a previous run.')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Slowdown ratio reported as a regression.')
+    parser.add_argument('--noise-ms', type=float, default=0.5,
+                        help='Ignore slowdowns smaller than this many milliseconds.')
+    args = parser.parse_args()
+
+    results = {'python': platform.python_version(), 'repeat': args.repeat, 'sizes': {}}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes.split(','):
+            drivers, laps = (int(part) for part in size.split('x'))
+            print(f"Benchmarking {drivers} drivers x {laps} laps", file=sys.stderr)
+            results['sizes'][size] = run_size(drivers, laps, args.repeat, Path(workdir))
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + '\n')
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.threshold,
+                              args.noise_ms)
+        sys.exit(1 if regressions else 0)
+    if not args.output:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Generate synthetic race data in the formats of the data folder.
+
+Run from the project folder:
+
+    python benchmarks/synthetic.py OUTPUT_DIR [--drivers 1000] [--laps 10] [--seed 1]
+"""
+import argparse
+import random
+import string
+import sys
+from datetime import datetime, timedelta
+from itertools import product
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import report_racers  # noqa: E402
+
+RACE_START = datetime(2018, 5, 24, 12, 0, 0)
+TEAMS = ('FERRARI', 'MERCEDES', 'RED BULL RACING TAG HEUER', 'MCLAREN RENAULT',
+         'WILLIAMS MERCEDES', 'SAUBER FERRARI', 'HAAS FERRARI', 'RENAULT')
+
+
+def driver_codes(count):
+    """Return count distinct three-letter driver codes."""
+    if count > 26 ** 3:
+        raise ValueError(f"At most {26 ** 3} drivers can have distinct codes")
+    return [''.join(letters) for letters, _ in zip(product(string.ascii_uppercase, repeat=3),
+                                                   range(count))]
+
+
+def format_timestamp(moment):
+    """Format a datetime the way start.log and end.log store it (milliseconds)."""
+    return moment.strftime(report_racers.DATETIME_FORMAT)[:-3]
+
+
+def interleave(rng, lines_by_driver):
+    """
+    Merge the lines of all drivers in random order, keeping the order of each driver's lines.
+
+    The swap correction (see report_racers.swap_records) compares the first start and
+    end line of a driver, so a later lap must never come before the first one.
+    """
+    slots = [index for index, lines in enumerate(lines_by_driver) for _ in lines]
+    rng.shuffle(slots)
+    iterators = [iter(lines) for lines in lines_by_driver]
+    return [next(iterators[index]) for index in slots]
+
+
+def generate_data(folder, drivers=1000, laps=1, seed=1, swapped=0.05):
+    """
+    Write abbreviations.txt, start.log and end.log for a synthetic race.
+
+    Every driver gets laps start and end lines, so each log has drivers * laps lines.
+    The lines of the drivers are interleaved in random order like the timing system
+    writes them, each driver's lines staying in lap order, and a share of the drivers
+    get their first start and end times exchanged, as in the real data (see
+    report_racers.swap_records).
+
+    Args:
+        folder (Path): The folder to write to, created if missing.
+        drivers (int): The number of drivers.
+        laps (int): The number of start/end lines per driver.
+        seed (int): The seed of the random generator, the same seed gives the same files.
+        swapped (float): The share of drivers with exchanged first start and end times.
+
+    Returns:
+        Path: The folder.
+    """
+    rng = random.Random(seed)
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    codes = driver_codes(drivers)
+    start_lines = [[] for _ in codes]
+    end_lines = [[] for _ in codes]
+    with open(folder / report_racers.ABBR_FILE.name, 'w') as fp:
+        for number, code in enumerate(codes, 1):
+            fp.write(f"{code}_Driver {number}_{rng.choice(TEAMS)}\n")
+    for index, code in enumerate(codes):
+        moment = RACE_START + timedelta(milliseconds=rng.randrange(0, 20 * 60 * 1000))
+        for lap in range(laps):
+            start = moment
+            moment += timedelta(milliseconds=rng.randrange(60 * 1000, 80 * 1000))
+            end = moment
+            if lap == 0 and rng.random() < swapped:
+                start, end = end, start
+            start_lines[index].append(f"{code}{format_timestamp(start)}\n")
+            end_lines[index].append(f"{code}{format_timestamp(end)}\n")
+    (folder / report_racers.STARTLOG_FILE.name).write_text(''.join(interleave(rng, start_lines)))
+    (folder / report_racers.ENDLOG_FILE.name).write_text(''.join(interleave(rng, end_lines)))
+    return folder
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('output', type=Path)
+    parser.add_argument('--drivers', type=int, default=1000)
+    parser.add_argument('--laps', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    generate_data(args.output, args.drivers, args.laps, args.seed)
+    print(f"Wrote {args.drivers} drivers, {args.drivers * args.laps} lines per log to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
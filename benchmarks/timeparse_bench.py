@@ -0,0 +1,52 @@
+"""
+Compare timeparse.parse_datetime with datetime.strptime on the log timestamps.
+
+Run from the project folder:
+
+    python benchmarks/timeparse_bench.py [--repeat 5] [--lines 100000]
+"""
+import argparse
+import sys
+import timeit
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import report_racers  # noqa: E402
+import timeparse  # noqa: E402
+
+
+def load_timestamps(count):
+    """Return count timestamps built by repeating the ones of start.log and end.log."""
+    lines = (report_racers.read_data_file(report_racers.STARTLOG_FILE)
+             + report_racers.read_data_file(report_racers.ENDLOG_FILE))
+    timestamps = [line[3:] for line in lines]
+    return (timestamps * (count // len(timestamps) + 1))[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--lines', type=int, default=100000)
+    args = parser.parse_args()
+
+    timestamps = load_timestamps(args.lines)
+    strptime_result = [datetime.strptime(text, report_racers.DATETIME_FORMAT) for text in timestamps]
+    assert [timeparse.parse_datetime(text) for text in timestamps] == strptime_result
+
+    timings = {
+        'strptime': min(timeit.repeat(
+            lambda: [datetime.strptime(text, report_racers.DATETIME_FORMAT) for text in timestamps],
+            number=1, repeat=args.repeat)),
+        'timeparse': min(timeit.repeat(
+            lambda: [timeparse.parse_datetime(text) for text in timestamps],
+            number=1, repeat=args.repeat)),
+    }
+    for name, seconds in timings.items():
+        print(f"{name:>10}: {seconds:.3f}s, {args.lines / seconds:,.0f} lines/s")
+    print(f"   speedup: {timings['strptime'] / timings['timeparse']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import click
+from flask.cli import AppGroup
+from follower import LogFollower
+import migrations
+import report_racers
+from profiling import IngestStats, profiled
+
+racers_cli = AppGroup('racers', help='Manage the racing results database.')
+
+stats_option = click.option('--stats', 'show_stats', is_flag=True,
+                            help='Print the time and rows per second of every import stage.')
+profile_option = click.option('--profile', type=click.Path(dir_okay=False),
+                              help='Profile the import with cProfile and write the pstats file here.')
+
+
+def echo_stats(stats, show_stats, summary):
+    """Print the stage table and the profile summary that were asked for."""
+    if show_stats:
+        click.echo(stats.format())
+    if summary.getvalue():
+        click.echo(summary.getvalue())
+
+
+@racers_cli.command('migrate')
+def migrate_command():
+    """Create missing tables and migrate the database schema."""
+    version = migrations.migrate_database()
+    click.echo(f"Database schema is at version {version}")
+
+
+@racers_cli.command('import')
+@click.option('--if-changed', is_flag=True,
+              help='Skip the import when the source files did not change since the last import.')
+@click.option('--hash', 'use_hash', is_flag=True,
+              help='Detect changes by file contents instead of size and modification time.')
+@stats_option
+@profile_option
+def import_command(if_changed, use_hash, show_stats, profile):
+    """Import the data files and recompute the result times."""
+    migrations.migrate_database()
+    stats = IngestStats()
+    with profiled(profile) as summary:
+        imported = report_racers.import_data(only_if_changed=if_changed, use_hash=use_hash,
+                                             stats=stats)
+    click.echo("Data imported" if imported else "Data not imported")
+    echo_stats(stats, show_stats, summary)
+
+
+@racers_cli.command('import-sessions')
+@click.argument('root', type=click.Path(exists=True, file_okay=False))
+@click.option('--workers', type=click.IntRange(min=1), default=None,
+              help='Number of processes parsing the files (default: number of CPUs).')
+@stats_option
+@profile_option
+def import_sessions_command(root, workers, show_stats, profile):
+    """Import every session folder below ROOT (folders with the three data files)."""
+    migrations.migrate_database()
+    stats = IngestStats()
+    with profiled(profile) as summary:
+        result = report_racers.ingest_sessions(root, workers=workers, stats=stats)
+    click.echo(f"Imported {len(result['sessions'])} sessions: {result['files']} files, "
+               f"{result['rows']} rows in {result['seconds']:.2f}s "
+               f"({result['rows_per_second']:.0f} rows/s)")
+    echo_stats(stats, show_stats, summary)
+
+
+@racers_cli.command('follow')
+@click.option('--interval', type=click.FloatRange(min=0.05), default=1.0, show_default=True,
+              help='Seconds between two reads of the logs.')
+def follow_command(interval):
+    """Ingest the lines appended to the logs of the data folder until interrupted."""
+    migrations.migrate_database()
+    click.echo("Following the logs, press Ctrl+C to stop")
+    try:
+        LogFollower().follow(interval, on_poll=lambda codes: click.echo(
+            f"Updated {len(codes)} drivers: {', '.join(sorted(codes))}"))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,134 @@
+import threading
+from db import get_database, StartLogModel, EndLogModel
+import report_racers
+import timeparse
+
+
+class LogFollower:
+    """
+    Ingest the lines appended to the start and end logs of the single race.
+
+    The timing system keeps appending to start.log and end.log during a live session.
+    Every poll reads only the bytes written after the offset reached by the previous
+    poll, stores the new log records and recomputes the result times of the drivers
+    that got new records (result_update with incremental=True), which increases the
+    data generation and so refreshes the report cache and the snapshots.
+
+    The offsets are stored in MetaModel, in the same transaction as the records, so a
+    restarted follower continues where the previous one stopped; report_racers.import_data
+    stores the offsets of the lines it imported, so following an imported race starts
+    after them. A line is ingested once its newline is written; a file that shrank or
+    was replaced is read again from the start (the records that are already stored
+    are skipped).
+
+    Args:
+        data_dir (Path, optional): The folder with the data files, DATA_DIR by default.
+    """
+
+    def __init__(self, data_dir=None):
+        self.abbr_file, startlog_file, endlog_file = report_racers._data_files(data_dir)
+        self.logs = ((StartLogModel, startlog_file), (EndLogModel, endlog_file))
+        self._abbr_stat = None
+        self._driver_ids = {}
+
+    def _sync_drivers(self):
+        """Upsert the drivers when the abbreviations file changed, return the code -> id map."""
+        stat = self.abbr_file.stat()
+        abbr_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if abbr_stat != self._abbr_stat:
+            drivers = report_racers.parse_abbreviations(report_racers.read_data_file(self.abbr_file))
+            self._driver_ids = report_racers._upsert_drivers(drivers)
+            self._abbr_stat = abbr_stat
+        return self._driver_ids
+
+    def _read_new_lines(self, file_path):
+        """
+        Read the complete lines appended to a log since the stored offset.
+
+        Returns:
+            tuple: (lines, position), position being the '<inode>:<offset>' value to
+                   store once the lines are saved, or None if it did not change.
+        """
+        stat = file_path.stat()
+        inode, offset = None, 0
+        stored = report_racers.get_meta(report_racers.log_offset_key(file_path))
+        if stored:
+            inode, offset = (int(part) for part in stored.split(':'))
+        if inode != stat.st_ino or stat.st_size < offset:
+            # Файл заменен или обрезан: читаем его заново
+            offset = 0
+        chunk = b''
+        if stat.st_size > offset:
+            with open(file_path, 'rb') as fp:
+                fp.seek(offset)
+                chunk = fp.read(stat.st_size - offset)
+        # Незаконченная последняя строка остается до следующего опроса
+        end = chunk.rfind(b'\n') + 1
+        lines = [line.strip().decode('ascii') for line in chunk[:end].splitlines()]
+        position = f'{stat.st_ino}:{offset + end}'
+        return [line for line in lines if line], None if position == stored else position
+
+    @staticmethod
+    def _new_records(model, records, driver_ids):
+        """Return the records that are not stored yet, checking only the drivers they belong to."""
+        ids = {driver_ids[code] for code, _ in records}
+        if not ids:
+            return []
+        stored = set(model
+                     .select(model.driver, model.datetime)
+                     .where(model.driver.in_(list(ids)) & model.session.is_null())
+                     .tuples())
+        return [(code, data_time) for code, data_time in records
+                if (driver_ids[code], data_time) not in stored]
+
+    def poll(self):
+        """
+        Ingest the complete lines appended since the previous poll.
+
+        The records are written in one transaction with the new offsets. If anything
+        fails (e.g. a line of a driver missing from the abbreviations), the transaction
+        is rolled back, the error is printed and the same lines are read again by the
+        next poll.
+
+        Returns:
+            set: The codes of the drivers with records that were not stored before.
+        """
+        codes = set()
+        with get_database().atomic() as transaction:
+            try:
+                driver_ids = self._sync_drivers()
+                for model, file_path in self.logs:
+                    lines, position = self._read_new_lines(file_path)
+                    records = self._new_records(model, timeparse.parse_log_lines(lines),
+                                                driver_ids)
+                    report_racers._insert_logs(model, records, driver_ids)
+                    codes.update(code for code, _ in records)
+                    if position is not None:
+                        report_racers.set_meta(report_racers.log_offset_key(file_path), position)
+                for code in codes:
+                    report_racers.swap_times(code)
+            except Exception as e:
+                transaction.rollback()
+                self._abbr_stat = None
+                print(f"Error following logs {e}")
+                return set()
+        if codes:
+            report_racers.result_update(incremental=True)
+        return codes
+
+    def follow(self, interval=1.0, stop=None, on_poll=None):
+        """
+        Poll the logs every interval seconds until stop is set.
+
+        Args:
+            interval (float): Seconds between two polls.
+            stop (threading.Event, optional): Set it to end the loop; runs forever by default.
+            on_poll (callable, optional): Called with the set returned by every poll
+                                          that ingested something.
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            codes = self.poll()
+            if codes and on_poll:
+                on_poll(codes)
+            stop.wait(interval)
@@ -0,0 +1,186 @@
+import json
+import threading
+import time
+from collections import deque
+import report_racers
+
+# Сколько последних изменений помнит лента для переподключившихся клиентов
+HISTORY_SIZE = 100
+
+
+def load_standings(session=None):
+    """
+    Return the current standings.
+
+    Args:
+        session (int, optional): The id of the session, see report_racers.get_all_racer.
+
+    Returns:
+        dict: Mapping of driver code to a dict with 'code', 'result_time' and
+              'position' (1 for the fastest driver).
+    """
+    return {racer['code']: {'code': racer['code'], 'result_time': racer['result_time'],
+                            'position': position}
+            for position, racer in enumerate(report_racers.get_all_racer('asc', session), 1)}
+
+
+def diff_standings(old, new):
+    """
+    Return the changes between two standings built by load_standings.
+
+    Args:
+        old (dict): The previous standings.
+        new (dict): The current standings.
+
+    Returns:
+        list: The entries of new that differ from old, ordered by position, followed
+              by the drivers that left the standings with result_time and position None.
+    """
+    changed = sorted((entry for code, entry in new.items() if old.get(code) != entry),
+                     key=lambda entry: entry['position'])
+    removed = [{'code': code, 'result_time': None, 'position': None}
+               for code in sorted(old.keys() - new.keys())]
+    return changed + removed
+
+
+def format_event(event, data, event_id):
+    """Return one Server-Sent Events message."""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class StandingsFeed:
+    """
+    Live standings of one race or session, shared by all the clients following it.
+
+    There is no background thread: a subscriber that finds the data older than
+    interval checks the data generation (see report_racers.get_generation) itself.
+    The check is guarded by a lock, so the standings are read from the database at
+    most once per interval and per change, however many clients are connected. The
+    changes are kept as numbered delta events and every waiting subscriber is woken up.
+
+    Args:
+        session (int, optional): The id of the session, None for the single race.
+        interval (float): Seconds between two checks of the data generation.
+    """
+
+    def __init__(self, session=None, interval=1.0):
+        self.session = session
+        self.interval = interval
+        self.version = 0
+        self._standings = {}
+        self._generation = None
+        self._checked = None
+        self._events = deque(maxlen=HISTORY_SIZE)
+        self._condition = threading.Condition()
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Publish the changes of the standings if the data generation changed.
+
+        Returns:
+            bool: True if a delta event was published. False if nothing changed or
+                  another subscriber is refreshing the feed right now.
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+        try:
+            self._checked = time.monotonic()
+            generation = report_racers.get_generation()
+            if generation == self._generation:
+                return False
+            standings = load_standings(self.session)
+            deltas = diff_standings(self._standings, standings)
+            with self._condition:
+                self._generation = generation
+                self._standings = standings
+                if deltas:
+                    self.version += 1
+                    self._events.append((self.version, deltas))
+                    self._condition.notify_all()
+            return bool(deltas)
+        finally:
+            self._refresh_lock.release()
+
+    def _is_stale(self):
+        return self._checked is None or time.monotonic() - self._checked >= self.interval
+
+    def _snapshot(self):
+        """Return (version, standings ordered by position); call with the condition held."""
+        return self.version, sorted(self._standings.values(), key=lambda entry: entry['position'])
+
+    def subscribe(self, last_event_id=None, heartbeat=15.0):
+        """
+        Generate the Server-Sent Events messages of one client.
+
+        The first message is a 'standings' event with the full standings, unless
+        last_event_id is still in the history of the feed: then the client gets the
+        'delta' events it missed. A 'delta' event lists the drivers whose result time
+        or position changed. A comment line is sent after heartbeat seconds without
+        events so that proxies keep the connection open.
+
+        Args:
+            last_event_id (str, optional): The Last-Event-ID header of a reconnecting client.
+            heartbeat (float): Seconds of silence before a keep-alive comment.
+
+        Yields:
+            str: The messages.
+        """
+        if self._is_stale():
+            self.refresh()
+        with self._condition:
+            version = None
+            if last_event_id is not None and last_event_id.isdigit():
+                known = int(last_event_id)
+                oldest = self._events[0][0] if self._events else self.version + 1
+                if oldest - 1 <= known <= self.version:
+                    version = known
+            if version is None:
+                version, standings = self._snapshot()
+                message = format_event('standings', standings, version)
+            else:
+                message = None
+        if message:
+            yield message
+        sent = time.monotonic()
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.version > version, timeout=self.interval)
+                events = [(number, deltas) for number, deltas in self._events if number > version]
+                if events and events[0][0] > version + 1:
+                    # Клиент отстал больше, чем на длину истории: отправляем таблицу целиком
+                    version, standings = self._snapshot()
+                    events = []
+                    messages = [format_event('standings', standings, version)]
+                else:
+                    messages = [format_event('delta', deltas, number) for number, deltas in events]
+                    if events:
+                        version = events[-1][0]
+            if messages:
+                yield ''.join(messages)
+                sent = time.monotonic()
+                continue
+            if self._is_stale() and self.refresh():
+                continue
+            if time.monotonic() - sent >= heartbeat:
+                yield ": keep-alive\n\n"
+                sent = time.monotonic()
+
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+def get_feed(session=None, interval=1.0):
+    """Return the StandingsFeed of a session, creating it on first use."""
+    with _feeds_lock:
+        feed = _feeds.get(session)
+        if feed is None:
+            feed = _feeds[session] = StandingsFeed(session, interval)
+        return feed
+
+
+def clear_feeds():
+    """Forget all the feeds; the next subscribers start from the current standings."""
+    with _feeds_lock:
+        _feeds.clear()
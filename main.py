@@ -1,84 +1,157 @@
-from flask import Flask, render_template, request, jsonify, Response, url_for
+import os
+from functools import partial
+from flask import (Flask, Response, current_app, g, render_template, request, abort, url_for,
+                   stream_with_context)
 from flask_restful import Api, Resource
 from flasgger import Swagger
+from peewee import DoesNotExist
+from db import get_database
 import report_racers
-from db import db, DriverModel, StartLogModel, EndLogModel
-import xml.etree.ElementTree as ET
+import report_cache
+import snapshots
+import migrations
+import live
+import metrics
+from profiling import IngestStats, profiled
+from commands import racers_cli
+from renders import RENDERS
 
-app = Flask(__name__)
-api = Api(app)
-swagger = Swagger(app)
 
-db.create_tables([DriverModel, StartLogModel, EndLogModel], safe=True)
-report_racers.store_data_from_files_to_db()
-report_racers.result_update()
-
-
-@app.route('/report')
 def index():
     '''This route handles the main page'''
     order = request.args.get('order', 'asc')
-    sorted_data = report_racers.get_all_racer(order)
+    sorted_data = report_cache.get_all_racer(order)
     return render_template('index.html', report=sorted_data)
 
 
-@app.route('/report/drivers/')
 def info_in_drivers():
     '''shows a list of driver's names and codes. The code should be a link to info about drivers'''
     order = request.args.get('order', 'asc')
-    sorted_data = report_racers.get_all_racer(order)
+    sorted_data = report_cache.get_all_racer(order)
     return render_template('info_in_drivers.html', report=sorted_data)
 
 
-@app.route('/report/drivers/<name>')
 def name_page(name):
-    '''Returns a page with the name'''
-    order = request.args.get('order', 'asc')
-    sorted_data = report_racers.get_all_racer(order)
-    found_item = next(item for item in sorted_data if item['code'] == name)
+    '''Returns a page with the name, 404 if there is no driver with this code'''
+    try:
+        found_item = report_cache.get_racer_by_code(name)[0]
+    except DoesNotExist:
+        abort(404)
     return render_template('name_page.html', racer=found_item)
 
 
-class RenderXML:
-
-    @staticmethod
-    def dictxml(data):
-
-        root = ET.Element('drivers')
-        for racer in data:
-            driver_element = ET.SubElement(root, 'driver')
-            ET.SubElement(driver_element, 'time').text = racer['result_time']
-            data_element = ET.SubElement(driver_element, 'data')
-            ET.SubElement(data_element, 'code').text = racer['code']
-            ET.SubElement(data_element, 'name').text = racer['name']
-            ET.SubElement(data_element, 'team').text = racer['team']
-        return ET.tostring(root, encoding='utf-8', method='xml')
-
-    def render(self, data):
-        return Response(self.dictxml(data), mimetype='text/xml')
-
-
-class RenderJson:
-
-    @staticmethod
-    def render(data):
-        return data
-
-
 class RenderMixin:
-    renders = {
-        "json": RenderJson,
-        "xml": RenderXML
-    }
-
-    def render(self, data, format="json"):
+    renders = RENDERS
 
+    def get_render(self, format):
         render_ = self.renders.get(format)
         if not render_:
             raise ValueError(
-                f"Format does not support. Support formats are {
-                    self.renders}")
-        return render_().render(data)
+                f"Format does not support. Support formats are {self.renders}")
+        return render_()
+
+    def render(self, data, format="json"):
+        return self.get_render(format).render(data)
+
+    def get_session(self):
+        """
+        Return the id of the session requested with the session parameter.
+
+        Returns:
+            int: The id of an existing SessionModel, or None for the single race.
+        """
+        session = request.args.get('session')
+        if session is None:
+            return None
+        try:
+            session = int(session)
+        except ValueError:
+            abort(400, "Invalid session parameter. Use the id of a session.")
+        if not any(item['id'] == session for item in report_cache.get_sessions()):
+            abort(404)
+        return session
+
+    def render_snapshot(self, resource, key, format="json", session=None):
+        """
+        Serve the pre-rendered body of a resource from the snapshot store.
+
+        Args:
+            resource (str): 'report', 'drivers' or 'racer', see snapshots.SnapshotStore.get.
+            key (str): The sort order, or the driver code for 'racer'.
+            format (str): The response format, one of the keys of renders.
+            session (int, optional): The id of the session, see snapshots.session_snapshot.
+
+        Returns:
+            Response: The body with its ETag, or 304 if the client has it already.
+        """
+        self.get_render(format)
+        if session is None:
+            snapshot = snapshots.store.get((resource, key, format))
+        else:
+            snapshot = snapshots.session_snapshot(resource, key, format, session)
+        if snapshot is None:
+            abort(404)
+        return snapshot.response()
+
+    def render_page(self, order, format="json", transform=None, session=None):
+        """
+        Render one page of racers if the client asked for it with limit or after.
+
+        The page is cached by report_cache. When there are more racers, the URL of
+        the next page is sent in the Link header (rel="next").
+
+        Args:
+            order (str): The sort order, 'asc' or 'desc'.
+            format (str): The response format, one of the keys of renders.
+            transform (callable, optional): Applied to every racer of the page.
+            session (int, optional): The id of the session to report.
+
+        Returns:
+            Response: The page, or None if pagination was not requested.
+        """
+        if 'limit' not in request.args and 'after' not in request.args:
+            return None
+        render_ = self.get_render(format)
+        try:
+            limit = int(request.args.get('limit', report_racers.MAX_PAGE_SIZE))
+            after = request.args.get('after')
+            cursor = report_racers.parse_cursor(after) if after else None
+        except ValueError as e:
+            abort(400, str(e))
+        if not 0 < limit <= report_racers.MAX_PAGE_SIZE:
+            abort(400, f"limit must be between 1 and {report_racers.MAX_PAGE_SIZE}")
+        racers, next_cursor = report_cache.cached(
+            ('page', order, limit, cursor, session),
+            lambda: report_racers.get_racer_page(order, limit, cursor, session))
+        if transform:
+            racers = [transform(racer) for racer in racers]
+        response = Response(render_.dumps(racers), mimetype=render_.mimetype)
+        if next_cursor:
+            next_url = url_for(request.endpoint, order=order, format=format, session=session,
+                               limit=limit, after=next_cursor, _external=True)
+            response.headers['Link'] = f'<{next_url}>; rel="next"'
+        return response
+
+    def render_stream(self, rows, format="json"):
+        """
+        Stream the rows in the given format if the client asked for it with stream=1
+        or the format is always streamed (ndjson).
+
+        Args:
+            rows (iterable): Racer dictionaries read lazily from the database.
+            format (str): The response format, one of the keys of renders.
+
+        Returns:
+            Response: A streamed response, or None if streaming was not requested
+                      or the format does not support it.
+        """
+        render_ = self.get_render(format)
+        requested = request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+        if not (requested or getattr(render_, 'always_stream', False)):
+            return None
+        if not hasattr(render_, 'stream'):
+            return None
+        return render_.stream(rows)
 
 
 class IndexApi(Resource, RenderMixin):
@@ -93,15 +166,29 @@ class IndexApi(Resource, RenderMixin):
     Query Parameters:
         order (str): Specifies the order of sorting ('asc' for ascending, 'desc' for descending).
                      Defaults to 'asc'.
-        format (str): Specifies the format of the response ('json' or other formats supported by render method).
+        format (str): Specifies the format of the response ('json', 'xml' or 'ndjson').
                       Defaults to 'json'.
+        stream (str): '1' to stream the response while it is read from the database.
+                      'ndjson' responses are always streamed.
+        limit (int): Return at most this many racers (up to report_racers.MAX_PAGE_SIZE). The URL of
+                     the next page is sent in the Link header.
+        after (str): The '<result_time>,<id>' cursor of the page to continue after.
+        session (int): The id of the session to report (see SessionsApi). Defaults to
+                       the single race imported from the data folder.
     """
 
     def get(self):
         order = request.args.get('order', 'asc')
         format_param = request.args.get('format', 'json')
-        sorted_data = report_racers.get_all_racer(order)
-        return self.render(sorted_data, format_param)
+        if order not in snapshots.ORDERS:
+            abort(400, "Invalid order parameter. Use 'asc' or 'desc'.")
+        session = self.get_session()
+        page = self.render_page(order, format_param, session=session)
+        if page:
+            return page
+        streamed = self.render_stream(
+            report_racers.iter_all_racer(order, session), format_param)
+        return streamed or self.render_snapshot('report', order, format_param, session)
 
 
 class InfoDriver(Resource, RenderMixin):
@@ -116,21 +203,30 @@ class InfoDriver(Resource, RenderMixin):
     Query Parameters:
         order (str): Specifies the order of sorting ('asc' for ascending, 'desc' for descending).
                      Defaults to 'asc'.
-        format (str): Specifies the format of the response ('json' or other formats supported by render method).
+        format (str): Specifies the format of the response ('json', 'xml' or 'ndjson').
                       Defaults to 'json'.
+        stream (str): '1' to stream the response while it is read from the database.
+                      'ndjson' responses are always streamed.
+        limit (int): Return at most this many racers (up to report_racers.MAX_PAGE_SIZE). The URL of
+                     the next page is sent in the Link header.
+        after (str): The '<result_time>,<id>' cursor of the page to continue after.
+        session (int): The id of the session to report (see SessionsApi). Defaults to
+                       the single race imported from the data folder.
     """
 
     def get(self):
         order = request.args.get('order', 'asc')
         format_param = request.args.get('format', 'json')
-        sorted_data_info = report_racers.get_all_racer(order)
-        for racer in sorted_data_info:
-            racer['code'] = (
-                url_for(
-                    'namepage',
-                    name=racer['code'],
-                    _external=True))
-        return self.render(sorted_data_info, format_param)
+        if order not in snapshots.ORDERS:
+            abort(400, "Invalid order parameter. Use 'asc' or 'desc'.")
+        session = self.get_session()
+        driver_link = partial(snapshots.driver_link, session=session)
+        page = self.render_page(order, format_param, transform=driver_link, session=session)
+        if page:
+            return page
+        streamed = self.render_stream(
+            map(driver_link, report_racers.iter_all_racer(order, session)), format_param)
+        return streamed or self.render_snapshot('drivers', order, format_param, session)
 
 
 class NamePage(Resource, RenderMixin):
@@ -147,17 +243,189 @@ class NamePage(Resource, RenderMixin):
     Query Parameters:
         format (str): Specifies the format of the response ('json' or other formats supported by render method).
                       Defaults to 'json'.
+        session (int): The id of the session to report (see SessionsApi). Defaults to
+                       the single race imported from the data folder.
     """
 
     def get(self, name):
         format_param = request.args.get('format', 'json')
-        page = report_racers.get_racer_by_code(name)
-        return self.render(page, format_param)
+        return self.render_snapshot('racer', name, format_param, self.get_session())
+
+
+class LapsApi(Resource, RenderMixin):
+    """
+    API resource for retrieving the laps of a specific racer.
+
+    Methods:
+        get(name):
+            Returns the code, name and team of the racer, their best lap time and their
+            laps with the lap time, the elapsed time, the gap to the leader of the lap
+            and the position (see report_racers.get_laps). 404 if the racer has no lap.
+
+    Path Parameters:
+        name (str): The code of the racer.
+
+    Query Parameters:
+        session (int): The id of the session to report (see SessionsApi). Defaults to
+                       the single race imported from the data folder.
+    """
+
+    def get(self, name):
+        try:
+            return report_cache.get_laps(name, self.get_session())
+        except DoesNotExist:
+            abort(404)
+
+
+class TeamsApi(Resource, RenderMixin):
+    """
+    API resource for retrieving the aggregated results of the teams.
+
+    Methods:
+        get():
+            Returns the team, the number of drivers and the best, average and total
+            result time of every team, best team first (see report_racers.get_teams).
+
+    Query Parameters:
+        session (int): The id of the session to report (see SessionsApi). Defaults to
+                       the single race imported from the data folder.
+    """
+
+    def get(self):
+        return report_cache.get_teams(self.get_session())
 
 
-api.add_resource(InfoDriver, '/api/v1/report/drivers/')
-api.add_resource(IndexApi, '/api/v1/report/')
-api.add_resource(NamePage, '/api/v1/report/drivers/<name>/')
+class TeamApi(Resource, RenderMixin):
+    """
+    API resource for retrieving the aggregated results of one team with its racers.
+
+    Methods:
+        get(team):
+            Returns the values of TeamsApi for the team and its racers, fastest first.
+            404 if no racer of the team has a result time.
+
+    Path Parameters:
+        team (str): The name of the team, e.g. 'FERRARI'.
+
+    Query Parameters:
+        session (int): The id of the session to report (see SessionsApi). Defaults to
+                       the single race imported from the data folder.
+    """
+
+    def get(self, team):
+        try:
+            return report_cache.get_team(team, self.get_session())
+        except DoesNotExist:
+            abort(404)
+
+
+class LiveStream(Resource, RenderMixin):
+    """
+    API resource pushing the changes of the standings as Server-Sent Events.
+
+    Methods:
+        get():
+            Keeps the connection open and sends a 'standings' event with the code,
+            result_time and position of every driver, then a 'delta' event with the
+            drivers whose result time or position changed whenever the results change
+            (see live.StandingsFeed). All the clients of a session share one feed, so
+            the database is read once per change, not once per client.
+
+    Query Parameters:
+        session (int): The id of the session to follow (see SessionsApi). Defaults to
+                       the single race imported from the data folder.
+    """
+
+    def get(self):
+        feed = live.get_feed(self.get_session(), current_app.config['LIVE_INTERVAL'])
+        events = feed.subscribe(request.headers.get('Last-Event-ID'),
+                                current_app.config['LIVE_HEARTBEAT'])
+        response = Response(stream_with_context(events), mimetype='text/event-stream')
+        response.cache_control.no_cache = True
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class SessionsApi(Resource):
+    """
+    API resource listing the imported sessions.
+
+    Methods:
+        get():
+            Returns the id, race and name of every session, ordered by race and name.
+            The id is the value of the session parameter of the report resources.
+    """
+
+    def get(self):
+        return report_cache.get_sessions()
+
+
+def open_database():
+    """Connect to the database for the request, unless this thread has a connection open already."""
+    g.database_opened = get_database().connect(reuse_if_open=True)
+
+
+def close_database(exc):
+    """Close the connection opened by open_database once the response has been sent."""
+    if g.pop('database_opened', False):
+        get_database().close()
+
+
+def create_app(config=None):
+    """
+    Create and configure the Flask application.
+
+    Creating the application does not touch the database: the data files are imported
+    by the 'flask racers import' command (see commands.py), not at start-up. Every
+    request gets its own connection, closed when the response has been sent (see
+    open_database); the SQLite PRAGMAs and the read-only mode are configured in db.py.
+    The request latencies, SQL statements and cache lookups are served at /metrics
+    (see metrics.py).
+
+    Args:
+        config (dict, optional): Configuration values applied on top of the defaults.
+
+    Returns:
+        Flask: The configured application.
+    """
+    app = Flask(__name__)
+    app.config['LIVE_INTERVAL'] = 1.0
+    app.config['LIVE_HEARTBEAT'] = 15.0
+    if config:
+        app.config.update(config)
+    report_cache.init_app(app)
+    metrics.init_app(app)
+    app.before_request(open_database)
+    app.teardown_request(close_database)
+
+    app.add_url_rule('/report', view_func=index)
+    app.add_url_rule('/report/drivers/', view_func=info_in_drivers)
+    app.add_url_rule('/report/drivers/<name>', view_func=name_page)
+
+    api = Api(app)
+    api.add_resource(InfoDriver, '/api/v1/report/drivers/')
+    api.add_resource(IndexApi, '/api/v1/report/')
+    api.add_resource(NamePage, '/api/v1/report/drivers/<name>/')
+    api.add_resource(LapsApi, '/api/v1/report/drivers/<name>/laps/')
+    api.add_resource(TeamsApi, '/api/v1/report/teams/')
+    api.add_resource(TeamApi, '/api/v1/report/teams/<team>/')
+    api.add_resource(LiveStream, '/api/v1/report/stream')
+    api.add_resource(SessionsApi, '/api/v1/sessions/')
+
+    Swagger(app)
+    app.cli.add_command(racers_cli)
+    return app
+
+
+app = create_app()
 
 if __name__ == '__main__':
+    # RACERS_PROFILE=<file> профилирует запуск (миграции и импорт) через cProfile
+    stats = IngestStats()
+    with profiled(os.environ.get('RACERS_PROFILE')) as summary:
+        with stats.stage('migrate'):
+            migrations.migrate_database()
+        if report_racers.import_data(only_if_changed=True, stats=stats):
+            print(stats.format())
+    print(summary.getvalue(), end='')
     app.run(debug=True, host='127.0.0.1', port=5000)
@@ -0,0 +1,257 @@
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, g, request
+from db import get_database
+
+# Границы корзин гистограмм в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+# Число SQL-запросов за HTTP-запрос
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+slow_query_log = logging.getLogger('racers.slow_query')
+
+
+class Histogram:
+    """Counts of observed values per bucket, with their sum, as a Prometheus histogram."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        """Yield the _bucket (cumulative), _sum and _count lines of the histogram."""
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}"
+        yield f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {self.count}"
+        yield f"{name}_sum{_labels(labels)} {_number(self.sum)}"
+        yield f"{name}_count{_labels(labels)} {self.count}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def statement_kind(sql):
+    """Return the first keyword of a SQL statement, e.g. 'SELECT'."""
+    words = sql.lstrip(' (\n').split(None, 1)
+    return words[0].upper() if words else ''
+
+
+def _caller():
+    """Return 'module.function:line' of the innermost frame outside peewee and this module."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.split('.')[0] not in ('peewee', 'playhouse', __name__):
+            return f"{module}.{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return ''
+
+
+class Metrics:
+    """
+    Process-local counters of the HTTP requests, the SQL statements and the caches.
+
+    Every web worker process keeps its own values, like the report cache; Prometheus
+    adds up the scrapes of the workers. All methods are thread-safe.
+
+    Attributes:
+        slow_query_seconds (float): SQL statements taking at least this long are logged
+                                    to the 'racers.slow_query' logger with their SQL,
+                                    parameters, route and caller. None disables the log.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._context = threading.local()
+        self.slow_query_seconds = None
+        self.reset()
+
+    def reset(self):
+        """Forget all the recorded values."""
+        with self._lock:
+            self._requests = {}
+            self._latency = {}
+            self._statements_per_request = {}
+            self._sql = {}
+            self._cache = {}
+
+    def start_request(self, route):
+        """Start counting the SQL statements of the request handled by this thread."""
+        self._context.route = route
+        self._context.statements = 0
+
+    def end_request(self, method, route, status, seconds):
+        """Record a finished request, see start_request."""
+        statements = getattr(self._context, 'statements', 0)
+        self._context.route = None
+        with self._lock:
+            key = (method, route, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._latency.setdefault((method, route), Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self._statements_per_request.setdefault(
+                (method, route), Histogram(STATEMENT_BUCKETS)).observe(statements)
+
+    def observe_sql(self, sql, params, seconds):
+        """Record one SQL statement executed in seconds, logging it if it was slow."""
+        route = getattr(self._context, 'route', None)
+        if route is not None:
+            self._context.statements += 1
+        route = route or 'none'
+        kind = statement_kind(sql)
+        with self._lock:
+            self._sql.setdefault((route, kind), Histogram(SQL_BUCKETS)).observe(seconds)
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            slow_query_log.warning("Slow query %.1f ms in %s (route %s): %s %r",
+                                   seconds * 1000, _caller(), route, sql, params)
+
+    def record_cache(self, cache, hit):
+        """Count one lookup in a cache ('report', 'snapshot', 'asgi')."""
+        with self._lock:
+            key = (cache, 'hit' if hit else 'miss')
+            self._cache[key] = self._cache.get(key, 0) + 1
+
+    def render(self):
+        """Return all the values in the Prometheus text exposition format."""
+        with self._lock:
+            lines = ['# HELP racers_http_requests_total HTTP requests by route and status.',
+                     '# TYPE racers_http_requests_total counter']
+            lines += [f"racers_http_requests_total"
+                      f"{_labels((('method', method), ('route', route), ('status', status)))} {count}"
+                      for (method, route, status), count in sorted(self._requests.items())]
+            lines += ['# HELP racers_http_request_duration_seconds Time to produce the response.',
+                      '# TYPE racers_http_request_duration_seconds histogram']
+            for (method, route), histogram in sorted(self._latency.items()):
+                lines += histogram.samples('racers_http_request_duration_seconds',
+                                           (('method', method), ('route', route)))
+            lines += ['# HELP racers_http_request_sql_statements SQL statements per request.',
+                      '# TYPE racers_http_request_sql_statements histogram']
+            for (method, route), histogram in sorted(self._statements_per_request.items()):
+                lines += histogram.samples('racers_http_request_sql_statements',
+                                           (('method', method), ('route', route)))
+            lines += ['# HELP racers_sql_duration_seconds SQL statements by route and kind.',
+                      '# TYPE racers_sql_duration_seconds histogram']
+            for (route, kind), histogram in sorted(self._sql.items()):
+                lines += histogram.samples('racers_sql_duration_seconds',
+                                           (('route', route), ('statement', kind)))
+            lines += ['# HELP racers_cache_requests_total Cache lookups by result.',
+                      '# TYPE racers_cache_requests_total counter']
+            lines += [f"racers_cache_requests_total{_labels((('cache', cache), ('result', result)))} {count}"
+                      for (cache, result), count in sorted(self._cache.items())]
+            lines += ['# HELP racers_cache_hit_ratio Share of the cache lookups that were hits.',
+                      '# TYPE racers_cache_hit_ratio gauge']
+            for cache in sorted({cache for cache, _ in self._cache}):
+                hits = self._cache.get((cache, 'hit'), 0)
+                total = hits + self._cache.get((cache, 'miss'), 0)
+                lines.append(f"racers_cache_hit_ratio{_labels((('cache', cache),))} "
+                             f"{_number(hits / total)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Metrics()
+
+
+def instrument_database(database):
+    """
+    Time every statement executed by a peewee database (see Metrics.observe_sql).
+
+    The execution time of a SELECT covers running the statement up to the first row,
+    not fetching the remaining rows. Instrumenting a database twice has no effect.
+
+    Args:
+        database (Database): The database, e.g. db.get_database().
+
+    Returns:
+        Database: The database.
+    """
+    if getattr(database, '_metrics_instrumented', False):
+        return database
+    execute_sql = database.execute_sql
+
+    def timed_execute_sql(sql, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return execute_sql(sql, params, *args, **kwargs)
+        finally:
+            registry.observe_sql(sql, params, time.perf_counter() - started)
+
+    database.execute_sql = timed_execute_sql
+    database._metrics_instrumented = True
+    return database
+
+
+def _route():
+    # Шаблон маршрута, а не путь: иначе у каждого кода гонщика была бы своя метрика
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def start_timer():
+    """Start the timer of the request and instrument the database it will use."""
+    instrument_database(get_database())
+    g.metrics_started = time.perf_counter()
+    registry.start_request(_route())
+
+
+def record_status(response):
+    """Remember the status of the response for stop_timer."""
+    g.metrics_status = response.status_code
+    return response
+
+
+def stop_timer(exc):
+    """Record the request once the response has been sent (streamed bodies included)."""
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    status = 500 if exc is not None else g.pop('metrics_status', 500)
+    registry.end_request(request.method, _route(), status, time.perf_counter() - started)
+
+
+def metrics_view():
+    '''Returns the metrics of this process in the Prometheus text format'''
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+def init_app(app):
+    """
+    Record the requests of the application and serve them at /metrics.
+
+    The SLOW_QUERY_MS configuration value enables the slow query log (see
+    Metrics.slow_query_seconds).
+
+    Args:
+        app (Flask): The application to configure.
+    """
+    app.config.setdefault('SLOW_QUERY_MS', None)
+    slow_query_ms = app.config['SLOW_QUERY_MS']
+    registry.slow_query_seconds = None if slow_query_ms is None else slow_query_ms / 1000
+    app.before_request(start_timer)
+    app.after_request(record_status)
+    app.teardown_request(stop_timer)
+    app.add_url_rule('/metrics', view_func=metrics_view)
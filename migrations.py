@@ -0,0 +1,139 @@
+from peewee import fn, Select
+from playhouse.migrate import SchemaMigrator, migrate
+from db import (get_database, MODELS, DriverModel, SessionModel, StartLogModel, EndLogModel,
+                ResultModel, SessionDriverModel, StandingModel, CrossingModel, MetaModel)
+import report_racers
+
+SCHEMA_VERSION = 6
+
+
+def _deduplicate_drivers():
+    """Merge drivers sharing a code into the oldest row before the unique index on code is built."""
+    kept = {}
+    duplicates = {}
+    query = DriverModel.select(DriverModel.id, DriverModel.code).order_by(DriverModel.id)
+    for driver_id, code in query.tuples():
+        if code in kept:
+            duplicates.setdefault(kept[code], []).append(driver_id)
+        else:
+            kept[code] = driver_id
+    for keep_id, driver_ids in duplicates.items():
+        for model in (StartLogModel, EndLogModel):
+            model.update(driver=keep_id).where(model.driver.in_(driver_ids)).execute()
+        DriverModel.delete().where(DriverModel.id.in_(driver_ids)).execute()
+
+
+def _deduplicate_logs():
+    """Drop repeated (driver, datetime) log rows before the unique composite indexes are built."""
+    for model in (StartLogModel, EndLogModel):
+        first_ids = model.select(fn.MIN(model.id)).group_by(model.driver, model.datetime)
+        model.delete().where(model.id.not_in(first_ids)).execute()
+
+
+def _add_indexes():
+    """Version 1: unique index on DriverModel.code and on (driver, datetime) of the logs."""
+    _deduplicate_drivers()
+    _deduplicate_logs()
+
+
+def _add_sessions():
+    """
+    Version 2: the logs get a nullable session column, existing logs keep the single race.
+
+    The unique (driver, datetime) index of version 1 is replaced by the partial
+    indexes of db.add_log_indexes, created afterwards by create_tables.
+    """
+    database = get_database()
+    database.create_tables([SessionModel], safe=True)
+    migrator = SchemaMigrator.from_database(database)
+    for model in (StartLogModel, EndLogModel):
+        table_name = model._meta.table_name
+        migrate(migrator.add_column(table_name, 'session_id', model.session))
+        database.execute_sql(f'DROP INDEX IF EXISTS "{table_name}_driver_id_datetime"')
+
+
+def _add_standings():
+    """Version 3: the report is read from the materialized StandingModel table, filled from the stored results."""
+    get_database().create_tables([ResultModel, StandingModel], safe=True)
+    report_racers.rebuild_standings()
+    for session_id, in SessionModel.select(SessionModel.id).tuples():
+        report_racers.rebuild_standings(session_id)
+
+
+def _add_crossings():
+    """Version 4: the laps are read from the CrossingModel table, filled from the stored logs."""
+    get_database().create_tables([CrossingModel], safe=True)
+    report_racers.rebuild_crossings()
+    for session_id, in SessionModel.select(SessionModel.id).tuples():
+        report_racers.rebuild_crossings(session_id)
+
+
+def _add_team_aggregates():
+    """Version 5: StandingModel gets the result time in microseconds and a (session, team) index."""
+    # Таблица материализованная: проще пересоздать ее и заполнить заново
+    database = get_database()
+    database.drop_tables([StandingModel], safe=True)
+    database.create_tables([StandingModel])
+    report_racers.rebuild_standings()
+    for session_id, in SessionModel.select(SessionModel.id).tuples():
+        report_racers.rebuild_standings(session_id)
+
+
+def _add_session_drivers():
+    """
+    Version 6: the name and team of the drivers of a session are stored per session.
+
+    The sessions imported before get the current DriverModel values, the only ones
+    that were kept.
+    """
+    get_database().create_tables([SessionDriverModel], safe=True)
+    pairs = (StartLogModel
+             .select(StartLogModel.session, StartLogModel.driver)
+             .where(StartLogModel.session.is_null(False))
+             .distinct()
+             .alias('pairs'))
+    query = (Select([pairs], [pairs.c.session_id, pairs.c.driver_id, DriverModel.name,
+                              DriverModel.team])
+             .join(DriverModel, on=(DriverModel.id == pairs.c.driver_id)))
+    (SessionDriverModel
+     .insert_from(query, [SessionDriverModel.session, SessionDriverModel.driver,
+                          SessionDriverModel.name, SessionDriverModel.team])
+     .execute())
+
+
+# Шаги миграции: версия схемы -> функция, приводящая данные к этой версии
+MIGRATIONS = {
+    1: _add_indexes,
+    2: _add_sessions,
+    3: _add_standings,
+    4: _add_crossings,
+    5: _add_team_aggregates,
+    6: _add_session_drivers,
+}
+
+
+def migrate_database():
+    """
+    Create missing tables and bring an existing database to SCHEMA_VERSION.
+
+    The schema version is stored in MetaModel under 'schema_version'. Databases
+    created before versioning (version 0) that already contain drivers are cleaned
+    up by the steps in MIGRATIONS, so that the unique indexes can be built. Missing
+    tables and indexes are then created with create_tables(safe=True).
+
+    The migration runs within an atomic transaction.
+
+    Returns:
+        int: The schema version of the database after the migration.
+    """
+    database = get_database()
+    with database.atomic():
+        legacy = DriverModel.table_exists()
+        database.create_tables([MetaModel], safe=True)
+        version = int(report_racers.get_meta('schema_version', 0))
+        if legacy:
+            for step in range(version + 1, SCHEMA_VERSION + 1):
+                MIGRATIONS[step]()
+        database.create_tables(MODELS, safe=True)
+        report_racers.set_meta('schema_version', SCHEMA_VERSION)
+    return SCHEMA_VERSION
@@ -0,0 +1,158 @@
+import cProfile
+import io
+import pstats
+import time
+from contextlib import contextmanager
+
+
+class Stage:
+    """The accumulated wall time and row count of one stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.rows = 0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+class IngestStats:
+    """
+    Wall time and row counts of the stages of an import.
+
+    The time of a stage excludes the time of the stages nested in it, e.g. the
+    'log insert' stage does not count the time spent reading and parsing the lines
+    it inserts (see timed), so the stages add up to the time of the import. A stage
+    entered several times (one per session, for example) is accumulated.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._nested = [0.0]
+
+    def _stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage(name)
+        return stage
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        """
+        Time the block as the stage name.
+
+        Args:
+            name (str): The name of the stage.
+            rows (int): The number of rows the stage handles; the yielded Stage can
+                        also be given more rows inside the block.
+
+        Yields:
+            Stage: The accumulated stage.
+        """
+        stage = self._stage(name)
+        stage.rows += rows
+        self._nested.append(0.0)
+        started = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            elapsed = time.perf_counter() - started
+            stage.seconds += elapsed - self._nested.pop()
+            self._nested[-1] += elapsed
+
+    def timed(self, name, iterable):
+        """
+        Yield the items of iterable, timing their production as the stage name.
+
+        Every item counts as one row. Used for the streamed logs, whose lines are read
+        and parsed while the insert consumes them.
+        """
+        stage = self._stage(name)
+        iterator = iter(iterable)
+        while True:
+            # Без contextmanager: это выполняется для каждой строки лога
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed = time.perf_counter() - started
+                stage.seconds += elapsed
+                self._nested[-1] += elapsed
+            stage.rows += 1
+            yield item
+
+    @property
+    def seconds(self):
+        return sum(stage.seconds for stage in self.stages.values())
+
+    def as_dict(self):
+        """
+        Return the stages as plain data, e.g. for json.dumps.
+
+        Returns:
+            dict: 'seconds' (the total) and 'stages', a list of dicts with 'stage',
+                  'seconds', 'rows' and 'rows_per_second' in the order the stages started.
+        """
+        return {'seconds': self.seconds,
+                'stages': [{'stage': stage.name, 'seconds': stage.seconds, 'rows': stage.rows,
+                            'rows_per_second': stage.rows_per_second}
+                           for stage in self.stages.values()]}
+
+    def format(self):
+        """Return the stages as a text table with their share of the total time."""
+        total = self.seconds
+        lines = [f"{'stage':<24} {'seconds':>9} {'share':>6} {'rows':>9} {'rows/s':>11}"]
+        for stage in self.stages.values():
+            share = stage.seconds / total * 100 if total else 0.0
+            rate = f"{stage.rows_per_second:>11.0f}" if stage.rows else f"{'':>11}"
+            lines.append(f"{stage.name:<24} {stage.seconds:>9.4f} {share:>5.1f}% "
+                         f"{stage.rows or '':>9} {rate}")
+        lines.append(f"{'total':<24} {total:>9.4f}")
+        return '\n'.join(lines)
+
+
+class NullStats:
+    """Stands in for IngestStats when the caller did not ask for stage timings."""
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        yield Stage(name)
+
+    def timed(self, name, iterable):
+        return iterable
+
+
+NO_STATS = NullStats()
+
+
+@contextmanager
+def profiled(path=None, top=20):
+    """
+    Profile the block with cProfile if a path is given.
+
+    The statistics are written to path in the pstats format (open them with
+    `python -m pstats path` or snakeviz).
+
+    Args:
+        path (str, optional): The file to write; without it the block is not profiled.
+        top (int): The number of functions in the summary.
+
+    Yields:
+        io.StringIO: Filled after the block with the top functions by cumulative time.
+    """
+    summary = io.StringIO()
+    if path is None:
+        yield summary
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield summary
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(top)
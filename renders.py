@@ -0,0 +1,104 @@
+import json
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+from flask import Response, stream_with_context
+
+
+class RenderXML:
+    mimetype = 'text/xml'
+
+    @staticmethod
+    def dictxml(data):
+
+        root = ET.Element('drivers')
+        for racer in data:
+            driver_element = ET.SubElement(root, 'driver')
+            ET.SubElement(driver_element, 'time').text = racer['result_time']
+            data_element = ET.SubElement(driver_element, 'data')
+            ET.SubElement(data_element, 'code').text = racer['code']
+            ET.SubElement(data_element, 'name').text = racer['name']
+            ET.SubElement(data_element, 'team').text = racer['team']
+        return ET.tostring(root, encoding='utf-8', method='xml')
+
+    def dumps(self, data):
+        return self.dictxml(data)
+
+    def render(self, data):
+        return Response(self.dumps(data), mimetype=self.mimetype)
+
+    @staticmethod
+    def iter_xml(rows):
+        """
+        Serialize racers to the dictxml document piece by piece.
+
+        Args:
+            rows (iterable): Racer dictionaries, typically a generator over a query cursor.
+
+        Yields:
+            bytes: The opening tag, one <driver> element per racer and the closing tag.
+        """
+        yield b'<drivers>'
+        for racer in rows:
+            yield (
+                f"<driver><time>{escape(racer['result_time'])}</time>"
+                f"<data><code>{escape(racer['code'])}</code>"
+                f"<name>{escape(racer['name'])}</name>"
+                f"<team>{escape(racer['team'])}</team></data></driver>"
+            ).encode('utf-8')
+        yield b'</drivers>'
+
+    def stream(self, rows):
+        """Return a streamed response sending each <driver> element as soon as it is read."""
+        return Response(stream_with_context(self.iter_xml(rows)), mimetype=self.mimetype)
+
+
+class RenderJson:
+    mimetype = 'application/json'
+
+    @staticmethod
+    def dumps(data):
+        return json.dumps(data).encode('utf-8') + b'\n'
+
+    @staticmethod
+    def render(data):
+        return data
+
+    @staticmethod
+    def iter_json(rows):
+        """Serialize racers to a JSON array piece by piece, one element per racer."""
+        separator = b'['
+        for racer in rows:
+            yield separator + json.dumps(racer).encode('utf-8')
+            separator = b','
+        yield b']\n' if separator == b',' else b'[]\n'
+
+    def stream(self, rows):
+        """Return a streamed response sending each array element as soon as it is read."""
+        return Response(stream_with_context(self.iter_json(rows)), mimetype=self.mimetype)
+
+
+class RenderNDJson:
+    """Newline delimited JSON: one JSON object per racer and line. Always streamed for lists."""
+    mimetype = 'application/x-ndjson'
+    always_stream = True
+
+    @staticmethod
+    def iter_ndjson(rows):
+        for racer in rows:
+            yield json.dumps(racer).encode('utf-8') + b'\n'
+
+    def dumps(self, data):
+        return b''.join(self.iter_ndjson(data))
+
+    def render(self, data):
+        return Response(self.dumps(data), mimetype=self.mimetype)
+
+    def stream(self, rows):
+        return Response(stream_with_context(self.iter_ndjson(rows)), mimetype=self.mimetype)
+
+
+RENDERS = {
+    "json": RenderJson,
+    "xml": RenderXML,
+    "ndjson": RenderNDJson
+}
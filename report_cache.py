@@ -0,0 +1,84 @@
+from flask_caching import Cache
+import report_racers
+from metrics import registry
+
+cache = Cache()
+
+# Поколение данных, для которого заполнен кэш этого процесса
+_cached_generation = None
+
+
+def init_app(app):
+    """
+    Attach the report cache to the application.
+
+    Entries never expire by time: every key contains the data generation
+    (see report_racers.get_generation), so an import or a result update makes
+    the previous entries unreachable.
+
+    Args:
+        app (Flask): The application to configure.
+    """
+    app.config.setdefault('CACHE_TYPE', 'SimpleCache')
+    app.config.setdefault('CACHE_DEFAULT_TIMEOUT', 0)
+    cache.init_app(app)
+
+
+def cached(key, producer):
+    """
+    Return the value cached under key for the current data generation.
+
+    When the generation changes, the entries of the previous generations are
+    dropped before the new value is produced.
+
+    Args:
+        key (tuple): The parts of the cache key, e.g. ('report', 'asc', 'json').
+        producer (callable): Called without arguments to build the value on a miss.
+
+    Returns:
+        The cached or freshly produced value.
+    """
+    global _cached_generation
+    generation = report_racers.get_generation()
+    if generation != _cached_generation:
+        cache.clear()
+        _cached_generation = generation
+    cache_key = ':'.join(str(part) for part in (generation, *key))
+    value = cache.get(cache_key)
+    registry.record_cache('report', value is not None)
+    if value is None:
+        value = producer()
+        cache.set(cache_key, value)
+    return value
+
+
+def get_all_racer(order, session=None):
+    """Cached version of report_racers.get_all_racer."""
+    return cached(('all_racer', order, session),
+                  lambda: report_racers.get_all_racer(order, session))
+
+
+def get_racer_by_code(name, session=None):
+    """Cached version of report_racers.get_racer_by_code."""
+    return cached(('racer_by_code', name, session),
+                  lambda: report_racers.get_racer_by_code(name, session))
+
+
+def get_laps(name, session=None):
+    """Cached version of report_racers.get_laps."""
+    return cached(('laps', name, session), lambda: report_racers.get_laps(name, session))
+
+
+def get_teams(session=None):
+    """Cached version of report_racers.get_teams."""
+    return cached(('teams', session), lambda: report_racers.get_teams(session))
+
+
+def get_team(team, session=None):
+    """Cached version of report_racers.get_team."""
+    return cached(('team', team, session), lambda: report_racers.get_team(team, session))
+
+
+def get_sessions():
+    """Cached version of report_racers.get_sessions."""
+    return cached(('sessions',), report_racers.get_sessions)
@@ -1,6 +1,16 @@
+import hashlib
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
-from db import db, DriverModel, StartLogModel, EndLogModel
+from peewee import chunked, fn, Expression, NodeList, OP, SQL, Select, Tuple, Value
+import timeparse
+from profiling import NO_STATS
+from db import (get_database, is_postgres, DriverModel, SessionModel, StartLogModel,
+                EndLogModel, ResultModel, SessionDriverModel, StandingModel, CrossingModel,
+                MetaModel)
 
 ROOT = Path(__file__).resolve().parent
 DATA_DIR = ROOT / "data"
@@ -10,6 +20,9 @@ ENDLOG_FILE = DATA_DIR / "end.log"
 DATETIME_FORMAT = '%Y-%m-%d_%H:%M:%S.%f'
 STRTIME_FORMAT = '%M:%S.%f'
 TOP_DELIMITER = 15
+BATCH_SIZE = 100
+RESULT_TIME_FORMAT = '%H:%M:%S.%f'
+MAX_PAGE_SIZE = 1000
 
 
 def read_data_file(file_path: Path) -> list:
@@ -20,14 +33,90 @@ def read_data_file(file_path: Path) -> list:
         return content
 
 
-def get_all_racer(order):
+def iter_log_records(file_path):
+    """
+    Stream the (code, datetime) records of a start/end log.
+
+    The file is memory-mapped and read line by line, so only the current line is held
+    in memory. Surrounding whitespace and blank lines (end.log ends with one) are
+    skipped, timestamps are parsed by timeparse.parse_datetime.
+
+    Args:
+        file_path (Path): The log file.
+
+    Yields:
+        tuple: (code, datetime) records in file order.
+
+    Raises:
+        ValueError: If a line does not match the log format; the message contains the
+                    file name and the line number.
+    """
+    file_path = Path(file_path)
+    with open(file_path, 'rb') as fp:
+        # Пустой файл нельзя отобразить в память
+        if os.fstat(fp.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for number, line in enumerate(iter(mapped.readline, b''), 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    text = line.decode('ascii')
+                    record = (text[:3], timeparse.parse_datetime(text[3:]))
+                except ValueError as e:
+                    raise ValueError(f"{file_path.name} line {number}: {e}") from None
+                yield record
+
+
+def _standing_partition(session=None):
+    """Return the condition selecting the StandingModel rows of a session, or of the single race."""
+    return StandingModel.session.is_null() if session is None else StandingModel.session == session
+
+
+def _racer_query(order, session=None):
+    """
+    Build the query of (driver id, code, name, team, result_time) tuples sorted by result time.
+
+    The rows are read from the materialized StandingModel table alone (see
+    rebuild_standings), with one scan of its (session, result_time, driver) index.
+    """
     # Определяем порядок сортировки в зависимости от значения параметра order
+    # id гонщика - стабильный второй ключ для одинакового времени и для курсора страниц
+    if order == 'asc':
+        sort_order = (StandingModel.result_time.asc(), StandingModel.driver.asc())
+    elif order == 'desc':
+        sort_order = (StandingModel.result_time.desc(), StandingModel.driver.desc())
+    else:
+        raise ValueError("Invalid order parameter. Use 'asc' or 'desc'.")
+    return (StandingModel
+            .select(StandingModel.driver, StandingModel.code, StandingModel.name,
+                    StandingModel.team, StandingModel.result_time)
+            .where(_standing_partition(session))
+            .order_by(*sort_order)  # сортировка
+            .tuples())
+
+
+def _racer_to_dict(row):
+    """Convert a (driver id, code, name, team, result_time) row into the racer dictionary of the report functions."""
+    _, code, name, team, result_time = row
+    return {
+        'code': code,
+        'name': name,
+        'team': team,
+        'result_time': result_time
+    }
+
+
+def get_all_racer(order, session=None):
     """
     Retrieve and return a list of all racers with their details, sorted by their result time.
 
     Args:
         order (str): The order in which to sort the racers.
                      Accepts 'asc' for ascending order and 'desc' for descending order.
+        session (int, optional): The id of the SessionModel to report. By default the
+                                 single race imported from DATA_DIR is reported.
 
     Returns:
         list: A list of dictionaries, each containing the following keys:
@@ -39,28 +128,166 @@ def get_all_racer(order):
     Raises:
         ValueError: If the order parameter is not 'asc' or 'desc'.
     """
-    if order == 'asc':
-        sort_order = DriverModel.result_time.asc()
-    elif order == 'desc':
-        sort_order = DriverModel.result_time.desc()
-    else:
-        raise ValueError("Invalid order parameter. Use 'asc' or 'desc'.")
-    query = (
-        DriverModel .select(
-            DriverModel, StartLogModel.datetime.alias('start_time'), EndLogModel.datetime.alias('end_time')) .join(
-            StartLogModel, on=(
-                StartLogModel.driver_id == DriverModel.id)) .join(
-                    EndLogModel, on=(
-                        EndLogModel.driver_id == DriverModel.id)) .order_by(sort_order))  # сортировка
-    data_list = []
-    for driver in query:
-        data_list.append({
-            'code': driver.code,
-            'name': driver.name,
-            'team': driver.team,
-            'result_time': driver.result_time.strftime('%H:%M:%S.%f')
-        })
-    return data_list
+    return [_racer_to_dict(row) for row in _racer_query(order, session)]
+
+
+def iter_all_racer(order, session=None):
+    """
+    Iterate over all racers sorted by their result time without loading them all.
+
+    Only the reported columns are selected and the rows are read from the database
+    cursor one by one as tuples (Select.tuples().iterator()), so memory use does not
+    depend on the number of racers.
+
+    Args:
+        order (str): 'asc' for ascending order and 'desc' for descending order.
+        session (int, optional): The id of the SessionModel to report, see get_all_racer.
+
+    Yields:
+        dict: The racer dictionaries described in get_all_racer.
+
+    Raises:
+        ValueError: If the order parameter is not 'asc' or 'desc'.
+    """
+    for row in _racer_query(order, session).iterator():
+        yield _racer_to_dict(row)
+
+
+def parse_cursor(value):
+    """
+    Parse a page cursor in the '<result_time>,<id>' format.
+
+    Args:
+        value (str): The cursor, e.g. '00:01:04.415000,2'.
+
+    Returns:
+        tuple: (result_time, id) where result_time is normalized to RESULT_TIME_FORMAT.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    result_time, separator, driver_id = value.rpartition(',')
+    if not separator:
+        raise ValueError("Invalid cursor. Use '<result_time>,<id>'.")
+    result_time = datetime.strptime(result_time, RESULT_TIME_FORMAT).strftime(RESULT_TIME_FORMAT)
+    return result_time, int(driver_id)
+
+
+def get_racer_page(order, limit, after=None, session=None):
+    """
+    Retrieve one page of racers sorted by result time, using keyset pagination.
+
+    The racers are sorted by (result_time, id), the id makes the order stable for
+    equal times. The page starts right after the (result_time, id) of the cursor,
+    which the database resolves with a seek of the result_time index instead of
+    skipping rows with OFFSET.
+
+    Args:
+        order (str): 'asc' for ascending order and 'desc' for descending order.
+        limit (int): The maximum number of racers on the page.
+        after (tuple, optional): The (result_time, id) cursor returned with the
+                                 previous page, see parse_cursor.
+        session (int, optional): The id of the SessionModel to report, see get_all_racer.
+
+    Returns:
+        tuple: (racers, next_cursor) where racers is a list of the dictionaries
+               described in get_all_racer and next_cursor is the '<result_time>,<id>'
+               cursor of the next page, or None if this is the last page.
+
+    Raises:
+        ValueError: If the order parameter is not 'asc' or 'desc'.
+    """
+    query = _racer_query(order, session).limit(limit)
+    if after:
+        key = Tuple(StandingModel.result_time, StandingModel.driver)
+        query = query.where(key > Tuple(*after) if order == 'asc' else key < Tuple(*after))
+    rows = list(query)
+    racers = [_racer_to_dict(row) for row in rows]
+    next_cursor = None
+    if rows and len(rows) == limit:
+        next_cursor = f"{racers[-1]['result_time']},{rows[-1][0]}"
+    return racers, next_cursor
+
+
+def _team_query(session=None):
+    """
+    Build the query of the (team, drivers, best, average, total) aggregates of the standings.
+
+    One GROUP BY over the StandingModel rows of the race, read with its (session, team)
+    index; the times are in microseconds. The teams are sorted by their best time.
+    """
+    microseconds = StandingModel.result_microseconds
+    best = fn.MIN(microseconds)
+    return (StandingModel
+            .select(StandingModel.team, fn.COUNT(StandingModel.id), best,
+                    fn.AVG(microseconds), fn.SUM(microseconds))
+            .where(_standing_partition(session))
+            .group_by(StandingModel.team)
+            .order_by(best, StandingModel.team)
+            .tuples())
+
+
+def _team_to_dict(row):
+    """Convert a row of _team_query into the team dictionary of the report functions."""
+    team, drivers, best, average, total = row
+    return {
+        'team': team,
+        'drivers': drivers,
+        'best_time': format_microseconds(int(best)),
+        'average_time': format_microseconds(int(round(average))),
+        'total_time': format_microseconds(int(total)),
+    }
+
+
+def get_teams(session=None):
+    """
+    Retrieve the aggregated results of every team, best team first.
+
+    Args:
+        session (int, optional): The id of the SessionModel to report, see get_all_racer.
+
+    Returns:
+        list: A list of dictionaries, each containing the following keys:
+            - 'team': The name of the team.
+            - 'drivers': The number of drivers of the team with a result time.
+            - 'best_time', 'average_time', 'total_time': The shortest, the average and
+              the sum of the result times of the drivers, in the format '%H:%M:%S.%f'.
+    """
+    return [_team_to_dict(row) for row in _team_query(session)]
+
+
+def get_team(team, session=None):
+    """
+    Retrieve the aggregated results of one team with its drivers.
+
+    Args:
+        team (str): The name of the team, as in the abbreviations file.
+        session (int, optional): The id of the SessionModel to report, see get_all_racer.
+
+    Returns:
+        dict: The keys described in get_teams, and 'racers': the racer dictionaries
+              (see get_all_racer) of the drivers of the team, fastest first.
+
+    Raises:
+        peewee.DoesNotExist: If no driver of the team has a result time.
+    """
+    row = _team_query(session).where(StandingModel.team == team).first()
+    if row is None:
+        raise StandingModel.DoesNotExist(f"{team} has no results")
+    racers = _racer_query('asc', session).where(StandingModel.team == team)
+    return dict(_team_to_dict(row), racers=[_racer_to_dict(racer) for racer in racers])
+
+
+def get_sessions():
+    """
+    Retrieve all sessions ordered by race and name.
+
+    Returns:
+        list: A list of dictionaries with the 'id', 'race' and 'name' of each session.
+    """
+    query = SessionModel.select().order_by(SessionModel.race, SessionModel.name)
+    return [{'id': session.id, 'race': session.race, 'name': session.name}
+            for session in query]
 
 
 def swap_times(code):
@@ -69,6 +296,8 @@ def swap_times(code):
 
     This function retrieves the driver with the given code and checks if their start time
     is after their end time. If so, it swaps the times and saves the updated records to the database.
+    Like swap_records, only the first start and end logs of the single race (the logs
+    without a session) are compared; nothing happens while one of them is missing.
 
     Args:
         code (str): The code of the driver whose times need to be swapped.
@@ -79,8 +308,14 @@ def swap_times(code):
     """
     try:
         driver = DriverModel.get(DriverModel.code == code)
-        start_log = StartLogModel.get(StartLogModel.driver == driver.id)
-        end_log = EndLogModel.get(EndLogModel.driver == driver.id)
+        start_log, end_log = (
+            model.select()
+            .where((model.driver == driver.id) & model.session.is_null())
+            .order_by(model.id)
+            .first()
+            for model in (StartLogModel, EndLogModel))
+        if start_log is None or end_log is None:
+            return
         if start_log.datetime > end_log.datetime:
             start_datetime = start_log.datetime
             end_datetime = end_log.datetime
@@ -94,47 +329,487 @@ def swap_times(code):
         print(f"Error swap data {e}")
 
 
-def result_update():
+def get_meta(key, default=None):
+    """
+    Return the value stored in MetaModel under the given key.
+
+    Args:
+        key (str): The key of the entry.
+        default: The value returned when the key does not exist.
+
+    Returns:
+        str: The stored value, or default.
+    """
+    entry = MetaModel.get_or_none(MetaModel.key == key)
+    return entry.value if entry else default
+
+
+def set_meta(key, value):
+    """
+    Store a value in MetaModel under the given key, replacing the previous one.
+
+    Args:
+        key (str): The key of the entry.
+        value: The value to store, converted with str().
+    """
+    value = str(value)
+    (MetaModel
+     .insert(key=key, value=value)
+     .on_conflict(conflict_target=[MetaModel.key],
+                  update={MetaModel.value: value})
+     .execute())
+
+
+def get_generation():
+    """
+    Return the data generation counter.
+
+    The counter is increased every time the drivers or their result times change,
+    so it can be used as part of cache keys for exact invalidation.
+
+    Returns:
+        int: The current generation, 0 if the data was never changed.
+    """
+    return int(get_meta('generation', 0))
+
+
+def bump_generation():
+    """Increase the data generation counter stored in MetaModel by one."""
+    (MetaModel
+     .insert(key='generation', value='1')
+     .on_conflict(conflict_target=[MetaModel.key],
+                  update={MetaModel.value: (MetaModel.value.cast('INTEGER') + 1).cast('TEXT')})
+     .execute())
+
+
+def _microseconds(column):
+    """SQL expression converting a stored DateTimeField value to microseconds since the epoch."""
+    if is_postgres():
+        return (fn.EXTRACT(NodeList((SQL('EPOCH FROM'), column))) * 1000000).cast('BIGINT')
+    return (fn.strftime('%s', column).cast('INTEGER') * 1000000
+            + fn.substr(column, 21).cast('INTEGER'))
+
+
+def _format_duration(microseconds):
+    """SQL expression formatting a duration in microseconds the way TimeField stores it."""
+    if is_postgres():
+        # PostgreSQL хранит TimeField как time: интервал приводится к нему напрямую
+        return (SQL("INTERVAL '1 microsecond'") * microseconds).cast('TIME')
+    # peewee maps the % operator to GLOB/LIKE, so modulo is spelled out explicitly
+    return fn.printf('%02d:%02d:%02d.%06d',
+                     microseconds / 3600000000,
+                     Expression(microseconds / 60000000, OP.MOD, 60),
+                     Expression(microseconds / 1000000, OP.MOD, 60),
+                     Expression(microseconds, OP.MOD, 1000000))
+
+
+def _changed_driver_ids():
+    """Return ids of drivers with log entries added after the last result_update run."""
+    driver_ids = set()
+    for model in (StartLogModel, EndLogModel):
+        last_id = int(get_meta(f'result_update.{model._meta.table_name}', 0))
+        driver_ids.update(
+            driver_id for driver_id, in
+            model.select(model.driver).where(model.id > last_id).distinct().tuples())
+    return driver_ids
+
+
+def _store_log_watermarks():
+    """Remember the newest log ids so that the next incremental run starts after them."""
+    for model in (StartLogModel, EndLogModel):
+        last_id = model.select(fn.MAX(model.id)).scalar() or 0
+        set_meta(f'result_update.{model._meta.table_name}', last_id)
+
+
+def _durations(session=None):
+    """
+    Build the query of (driver_id, duration) rows of one partition of the logs.
+
+    The duration is the difference in microseconds between the latest end log and
+    the earliest start log of a driver, counting only the logs of the given session
+    (or the logs without a session).
+    """
+    if session is None:
+        partition = StartLogModel.session.is_null() & EndLogModel.session.is_null()
+    else:
+        partition = (StartLogModel.session == session) & (EndLogModel.session == session)
+    return (
+        StartLogModel
+        .select(StartLogModel.driver.alias('driver_id'),
+                (_microseconds(fn.MAX(EndLogModel.datetime))
+                 - _microseconds(fn.MIN(StartLogModel.datetime))).alias('duration'))
+        .join(EndLogModel, on=(EndLogModel.driver == StartLogModel.driver))
+        .where(partition)
+        .group_by(StartLogModel.driver))
+
+
+def _update_session_results(session):
+    """Upsert the ResultModel rows of a session with one INSERT ... SELECT ... ON CONFLICT."""
+    durations = _durations(session).alias('durations')
+    query = (Select([durations],
+                    [Value(session), durations.c.driver_id,
+                     _format_duration(durations.c.duration)])
+             .where(durations.c.duration >= 0))
+    (ResultModel
+     .insert_from(query, [ResultModel.session, ResultModel.driver, ResultModel.result_time])
+     .on_conflict(conflict_target=[ResultModel.session, ResultModel.driver],
+                  preserve=[ResultModel.result_time])
+     .execute())
+
+
+def _result_rows(session=None, driver_ids=None):
+    """Return the (driver id, code, name, team, result_time) rows of the computed results, fastest first."""
+    if session is None:
+        result_time = DriverModel.result_time
+        query = (DriverModel
+                 .select(DriverModel.id, DriverModel.code, DriverModel.name, DriverModel.team,
+                         result_time)
+                 .where(result_time.is_null(False)))
+    else:
+        # Имя и команда берутся из файла сокращений самой сессии
+        result_time = ResultModel.result_time
+        query = (DriverModel
+                 .select(DriverModel.id, DriverModel.code, SessionDriverModel.name,
+                         SessionDriverModel.team, result_time)
+                 .join(ResultModel, on=(ResultModel.driver == DriverModel.id))
+                 .join(SessionDriverModel, on=((SessionDriverModel.driver == DriverModel.id)
+                                               & (SessionDriverModel.session == session)))
+                 .where(ResultModel.session == session))
+    if driver_ids is not None:
+        query = query.where(DriverModel.id.in_(list(driver_ids)))
+    return query.order_by(result_time, DriverModel.id).tuples()
+
+
+def _time_microseconds(value):
+    """Convert a result time (datetime.time) to microseconds."""
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * 1000000 + value.microsecond
+
+
+def rebuild_standings(session=None, driver_ids=None):
+    """
+    Rebuild the StandingModel rows of a session, or of the single race.
+
+    The rows are replaced by the current results (DriverModel.result_time for the
+    single race, ResultModel for a session) with the time formatted and the rank
+    assigned, in batches of BATCH_SIZE rows. Call it inside the transaction that
+    changed the results, so readers never see a half-built table.
+
+    With driver_ids only the rows of those drivers are replaced; the ranks of the
+    race are then renumbered by one UPDATE ... FROM over a ROW_NUMBER window, which
+    writes only the rows whose rank changed (see result_update with incremental=True).
+
+    Args:
+        session (int, optional): The id of the SessionModel to rebuild.
+        driver_ids (iterable, optional): The ids of the drivers whose results changed.
+    """
+    standings = [
+        {'session': session, 'driver': driver_id, 'code': code, 'name': name, 'team': team,
+         'result_time': result_time.strftime(RESULT_TIME_FORMAT),
+         'result_microseconds': _time_microseconds(result_time), 'rank': rank}
+        for rank, (driver_id, code, name, team, result_time)
+        in enumerate(_result_rows(session, driver_ids), 1)]
+    partition = _standing_partition(session)
+    if driver_ids is not None:
+        partition &= StandingModel.driver.in_(list(driver_ids))
+    StandingModel.delete().where(partition).execute()
+    for batch in chunked(standings, BATCH_SIZE):
+        StandingModel.insert_many(batch).execute()
+    if driver_ids is not None:
+        _renumber_standings(session)
+
+
+def _renumber_standings(session=None):
+    """Reassign the ranks of a race in result order, updating only the rows whose rank changed."""
+    ranked = (StandingModel
+              .select(StandingModel.id,
+                      fn.ROW_NUMBER().over(order_by=[StandingModel.result_microseconds,
+                                                     StandingModel.driver]).alias('rank'))
+              .where(_standing_partition(session))
+              .alias('ranked'))
+    (StandingModel
+     .update({StandingModel.rank: ranked.c.rank})
+     .from_(ranked)
+     .where((StandingModel.id == ranked.c.id) & (StandingModel.rank != ranked.c.rank))
+     .execute())
+
+
+def _crossing_events(session=None, driver_ids=None):
+    """Build the UNION of the (driver_id, datetime) start and end log entries of one partition."""
+    selects = []
+    for model in (StartLogModel, EndLogModel):
+        partition = model.session.is_null() if session is None else model.session == session
+        if driver_ids is not None:
+            partition &= model.driver.in_(list(driver_ids))
+        selects.append(model
+                       .select(model.driver.alias('driver_id'), model.datetime.alias('datetime'))
+                       .where(partition))
+    # UNION убирает совпадающие отметки: конец круга - это начало следующего
+    return (selects[0] | selects[1]).alias('events')
+
+
+def _driver_laps(session=None, driver_ids=None):
+    """Build the (driver_id, datetime, lap, lap_time, elapsed) rows of the crossings, numbered per driver."""
+    events = _crossing_events(session, driver_ids)
+    microseconds = _microseconds(events.c.datetime)
+    by_driver = {'partition_by': [events.c.driver_id], 'order_by': [events.c.datetime]}
+    return Select([events], [
+        events.c.driver_id, events.c.datetime,
+        (fn.ROW_NUMBER().over(**by_driver) - 1).alias('lap'),
+        (microseconds - fn.LAG(microseconds).over(**by_driver)).alias('lap_time'),
+        (microseconds - fn.FIRST_VALUE(microseconds).over(**by_driver)).alias('elapsed'),
+    ])
+
+
+def _crossing_partition(session=None):
+    return CrossingModel.session.is_null() if session is None else CrossingModel.session == session
+
+
+def rebuild_crossings(session=None, driver_ids=None):
+    """
+    Rebuild the CrossingModel rows of a session, or of the single race.
+
+    The crossings of a driver are their start and end log entries in time order. The
+    laps are computed by one INSERT ... SELECT with window functions: ROW_NUMBER gives
+    the lap completed by a crossing, LAG the lap time and FIRST_VALUE the elapsed time
+    per driver; MIN and RANK over the drivers who completed the same lap give the gap
+    to the leader and the position. Call it inside the transaction that changed the
+    logs, like rebuild_standings.
+
+    With driver_ids only the laps of those drivers are computed and compared with the
+    stored ones: the rows that differ are replaced, and the gaps and positions are
+    recomputed for the laps they belong to only. A new crossing at the end of a lap
+    thus touches the rows of that lap, not the whole race (see result_update with
+    incremental=True).
+
+    Args:
+        session (int, optional): The id of the SessionModel to rebuild.
+        driver_ids (iterable, optional): The ids of the drivers whose logs changed.
+    """
+    if driver_ids is not None:
+        _update_crossings(session, driver_ids)
+        return
+    laps = _driver_laps(session).alias('laps')
+    query = Select([laps], [
+        SQL('NULL') if session is None else Value(session),
+        laps.c.driver_id, laps.c.datetime, laps.c.lap, laps.c.lap_time, laps.c.elapsed,
+        laps.c.elapsed - fn.MIN(laps.c.elapsed).over(partition_by=[laps.c.lap]),
+        fn.RANK().over(partition_by=[laps.c.lap], order_by=[laps.c.elapsed]),
+    ])
+    CrossingModel.delete().where(_crossing_partition(session)).execute()
+    (CrossingModel
+     .insert_from(query, [CrossingModel.session, CrossingModel.driver, CrossingModel.datetime,
+                          CrossingModel.lap, CrossingModel.lap_time, CrossingModel.elapsed,
+                          CrossingModel.gap, CrossingModel.position])
+     .execute())
+
+
+def _update_crossings(session, driver_ids):
+    """Replace the changed crossings of some drivers and rerank the laps they belong to."""
+    driver_ids = list(driver_ids)
+    partition = _crossing_partition(session)
+    stored = {(driver_id, lap): (row_id, data_time, lap_time, elapsed)
+              for row_id, driver_id, data_time, lap, lap_time, elapsed in
+              CrossingModel
+              .select(CrossingModel.id, CrossingModel.driver, CrossingModel.datetime,
+                      CrossingModel.lap, CrossingModel.lap_time, CrossingModel.elapsed)
+              .where(partition & CrossingModel.driver.in_(driver_ids))
+              .tuples()}
+    stale = []
+    rows = []
+    laps = set()
+    changed = _driver_laps(session, driver_ids).bind(get_database()).tuples()
+    for driver_id, data_time, lap, lap_time, elapsed in changed:
+        # Из подзапроса SQLite возвращает время строкой
+        data_time = CrossingModel.datetime.python_value(data_time)
+        old = stored.pop((driver_id, lap), None)
+        if old is not None and old[1:] == (data_time, lap_time, elapsed):
+            continue
+        if old is not None:
+            stale.append(old[0])
+        laps.add(lap)
+        rows.append({'session': session, 'driver': driver_id, 'datetime': data_time, 'lap': lap,
+                     'lap_time': lap_time, 'elapsed': elapsed, 'gap': 0, 'position': 0})
+    # Оставшиеся круги исчезли из логов
+    for (_, lap), (row_id, *_) in stored.items():
+        stale.append(row_id)
+        laps.add(lap)
+    if not laps:
+        return
+    for batch in chunked(stale, BATCH_SIZE):
+        CrossingModel.delete().where(CrossingModel.id.in_(batch)).execute()
+    for batch in chunked(rows, BATCH_SIZE):
+        CrossingModel.insert_many(batch).execute()
+    ranked = (CrossingModel
+              .select(CrossingModel.id,
+                      (CrossingModel.elapsed - fn.MIN(CrossingModel.elapsed)
+                       .over(partition_by=[CrossingModel.lap])).alias('gap'),
+                      fn.RANK().over(partition_by=[CrossingModel.lap],
+                                     order_by=[CrossingModel.elapsed]).alias('position'))
+              .where(partition & CrossingModel.lap.in_(sorted(laps)))
+              .alias('ranked'))
+    (CrossingModel
+     .update({CrossingModel.gap: ranked.c.gap, CrossingModel.position: ranked.c.position})
+     .from_(ranked)
+     .where(CrossingModel.id == ranked.c.id)
+     .execute())
+
+
+def format_microseconds(value):
+    """Format a duration in microseconds like the result times, '%H:%M:%S.%f'."""
+    seconds, microseconds = divmod(value, 1000000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}.{microseconds:06d}'
+
+
+def get_laps(name, session=None):
+    """
+    Retrieve the laps of a driver.
+
+    The best lap is marked by a MIN window over the laps of the driver, the other
+    values are read from CrossingModel as computed by rebuild_crossings.
+
+    Args:
+        name (str): The code of the driver.
+        session (int, optional): The id of the SessionModel to report, see get_all_racer.
+
+    Returns:
+        dict: The driver and their laps:
+            - code, name, team (str): The driver.
+            - best_lap (str): The shortest lap time, formatted like the result times.
+            - laps (list): One dictionary per lap, in order, with 'lap' (int, from 1),
+              'lap_time', 'elapsed' (since the first crossing) and 'gap' (behind the
+              leader of the lap) formatted like the result times, 'position' (int)
+              and 'best' (bool, True for the best lap).
+
+    Raises:
+        peewee.DoesNotExist: If no driver has the code, or the driver has no
+                             complete lap in the race.
+    """
+    driver = DriverModel.get(DriverModel.code == name)
+    driver_name, team = driver.name, driver.team
+    if session is not None:
+        listed = SessionDriverModel.get_or_none(session=session, driver=driver.id)
+        if listed is not None:
+            driver_name, team = listed.name, listed.team
+    partition = (CrossingModel.session.is_null() if session is None
+                 else CrossingModel.session == session)
+    best = fn.MIN(CrossingModel.lap_time).over(partition_by=[CrossingModel.driver])
+    query = (CrossingModel
+             .select(CrossingModel.lap, CrossingModel.lap_time, CrossingModel.elapsed,
+                     CrossingModel.gap, CrossingModel.position, best)
+             .where(partition & (CrossingModel.driver == driver.id) & (CrossingModel.lap > 0))
+             .order_by(CrossingModel.lap)
+             .tuples())
+    rows = list(query)
+    if not rows:
+        raise CrossingModel.DoesNotExist(f"{name} has no laps")
+    laps = [{'lap': lap, 'lap_time': format_microseconds(lap_time),
+             'elapsed': format_microseconds(elapsed), 'gap': format_microseconds(gap),
+             'position': position, 'best': lap_time == best_lap}
+            for lap, lap_time, elapsed, gap, position, best_lap in rows]
+    return {'code': driver.code, 'name': driver_name, 'team': team,
+            'best_lap': format_microseconds(rows[0][-1]), 'laps': laps}
+
+
+def _refresh_standing_drivers():
+    """
+    Copy changed driver names and teams into the standings of the single race with one UPDATE ... FROM.
+
+    The standings of the sessions keep the names and teams of their own abbreviations
+    (see SessionDriverModel) and are not touched.
+    """
+    (StandingModel
+     .update({StandingModel.name: DriverModel.name, StandingModel.team: DriverModel.team})
+     .from_(DriverModel)
+     .where(_standing_partition()
+            & (StandingModel.driver == DriverModel.id)
+            & ((StandingModel.name != DriverModel.name) | (StandingModel.team != DriverModel.team)))
+     .execute())
+
+
+def result_update(incremental=False, session=None):
     """
     Update the result times for all drivers.
 
-    This function iterates over all drivers in the database and calculates the result time
-    as the difference between the end log and start log times. It then updates the
-    driver's result time in the database.
+    The result time is the difference between the latest end log and the earliest
+    start log of a driver. It is computed for all drivers at once by a single
+    UPDATE ... FROM statement over the grouped start and end logs; drivers without
+    both logs, or with an end before the start, keep their current result time.
+
+    With incremental=True only the drivers whose logs were added since the previous
+    run are recomputed, and only their standings and crossings are replaced (see the
+    driver_ids of rebuild_standings and rebuild_crossings). The newest log ids are
+    stored in MetaModel after each run, and the data generation (see get_generation)
+    is increased.
+
+    With a session the results of that session are recomputed from its logs and
+    stored in ResultModel by a single INSERT ... SELECT upsert; incremental is
+    ignored then, a session is always recomputed as a whole.
+
+    In both cases the materialized standings and crossings of the race are rebuilt
+    in the same transaction (see rebuild_standings and rebuild_crossings).
 
     The updates are performed within an atomic transaction. If an error occurs during the
     process, the transaction is rolled back and an error message is printed to the console.
 
+    Args:
+        incremental (bool): Recompute only the drivers with new log entries.
+        session (int, optional): The id of the SessionModel to recompute. By default
+                                 the single race imported from DATA_DIR is recomputed.
+
+    Returns:
+        bool: True if the results are up to date (also when there was nothing to
+              recompute), False if the transaction was rolled back.
+
     Raises:
         Exception: If there is an error during the process, the transaction is rolled back
                    and an error message is printed to the console.
     """
-    drivers = DriverModel.select()
-    with db.atomic() as transaction:
+    with get_database().atomic() as transaction:
         try:
-            for driver in drivers:
-                start_log = StartLogModel.get_or_none(
-                    StartLogModel.driver == driver)
-                end_log = EndLogModel.get_or_none(EndLogModel.driver == driver)
-                if start_log and end_log:
-                    result_time = (end_log.datetime - start_log.datetime)
-                    driver.result_time = result_time
-                    driver.save()
+            if session is not None:
+                _update_session_results(session)
+                rebuild_standings(session)
+                rebuild_crossings(session)
+                bump_generation()
+                return True
+            durations = _durations()
+            driver_ids = None
+            if incremental:
+                driver_ids = _changed_driver_ids()
+                if not driver_ids:
+                    return True
+                durations = durations.where(StartLogModel.driver.in_(list(driver_ids)))
+            durations = durations.alias('durations')
+            (DriverModel
+             .update({DriverModel.result_time: _format_duration(durations.c.duration)})
+             .from_(durations)
+             .where((DriverModel.id == durations.c.driver_id)
+                    & (durations.c.duration >= 0))
+             .execute())
+            rebuild_standings(driver_ids=driver_ids)
+            rebuild_crossings(driver_ids=driver_ids)
+            _store_log_watermarks()
+            bump_generation()
         except Exception as e:
             transaction.rollback()
             print(f"Error updating result times {e}")
+            return False
+    return True
 
 
-def get_racer_by_code(name):
+def get_racer_by_code(name, session=None):
     """
     Retrieve a racer's details by their code.
 
-    This function fetches a driver from the database based on the provided code.
-    It then constructs a dictionary containing the driver's code, name, team, and
-    formatted result time.
+    This function fetches a driver from the database based on the provided code
+    (a single seek of the unique index on code). It then constructs a dictionary
+    containing the driver's code, name, team, and formatted result time.
 
     Args:
         name (str): The code of the driver to retrieve.
+        session (int, optional): The id of the SessionModel to report, see get_all_racer.
 
     Returns:
         list: A list containing a single dictionary with the driver's details:
@@ -144,26 +819,206 @@ def get_racer_by_code(name):
             - result_time (str): The driver's result time formatted as '%H:%M:%S.%f'.
 
     Raises:
-        peewee.DoesNotExist: If no driver with the given code exists in the database.
-    """
-    query = DriverModel.get(DriverModel.code == name)
-    racer_by_code = [{
-        'code': query.code,
-        'name': query.name,
-        'team': query.team,
-        'result_time': query.result_time.strftime('%H:%M:%S.%f')
-    }]
+        peewee.DoesNotExist: If no driver with the given code exists in the database,
+                             or the driver has no result time yet.
+    """
+    query = _racer_query('asc', session).where(StandingModel.code == name).get()
+    racer_by_code = [_racer_to_dict(query)]
     return racer_by_code
 
 
-def store_data_from_files_to_db():
+def parse_abbreviations(lines):
+    """
+    Parse abbreviation lines into driver rows.
+
+    Args:
+        lines (list): Lines in the '<code>_<name>_<team>' format.
+
+    Returns:
+        dict: Mapping of driver code to a dict with 'code', 'name' and 'team' keys.
+              Later lines override earlier ones for the same code.
+    """
+    drivers = {}
+    for line in lines:
+        code, name, team = line.split('_', 2)
+        drivers[code] = {'code': code, 'name': name, 'team': team}
+    return drivers
+
+
+def parse_log(lines):
+    """
+    Parse start/end log lines into (code, datetime) records.
+
+    Timestamps are parsed by timeparse.parse_datetime, a fixed-format replacement
+    for datetime.strptime(..., DATETIME_FORMAT).
+
+    Args:
+        lines (list): Lines in the '<code><DATETIME_FORMAT>' format.
+
+    Returns:
+        list: A list of (code, datetime) tuples in file order.
+
+    Raises:
+        ValueError: If a line does not match the format.
+    """
+    return timeparse.parse_log_lines(lines)
+
+
+def swap_records(start_records, end_records):
+    """
+    Swap start and end times in memory where the start is after the end.
+
+    This is the in-memory counterpart of swap_times: for every driver the first
+    start record is compared with the first end record and the two timestamps are
+    exchanged if they are out of order. The lists are modified in place.
+
+    Args:
+        start_records (list): (code, datetime) records from the start log.
+        end_records (list): (code, datetime) records from the end log.
+    """
+    first_start = {}
+    first_end = {}
+    for index, (code, _) in enumerate(start_records):
+        first_start.setdefault(code, index)
+    for index, (code, _) in enumerate(end_records):
+        first_end.setdefault(code, index)
+    for code, start_index in first_start.items():
+        end_index = first_end.get(code)
+        if end_index is None:
+            continue
+        start_datetime = start_records[start_index][1]
+        end_datetime = end_records[end_index][1]
+        if start_datetime > end_datetime:
+            start_records[start_index] = (code, end_datetime)
+            end_records[end_index] = (code, start_datetime)
+
+
+def _first_datetimes(records):
+    """Return the first datetime of every code in records; the memory is bounded by the number of drivers."""
+    first = {}
+    for code, data_time in records:
+        first.setdefault(code, data_time)
+    return first
+
+
+def _swap_replacements(startlog_file, endlog_file, stats=NO_STATS):
+    """
+    First pass of the streamed counterpart of swap_records.
+
+    Args:
+        startlog_file (Path): The start log.
+        endlog_file (Path): The end log.
+        stats (profiling.IngestStats, optional): Receives the time spent reading and
+                                                 parsing the logs as 'read/parse logs'.
+
+    Returns:
+        tuple: (start replacements, end replacements), dicts mapping the code of every
+               driver whose first start is after their first end to the datetime that
+               replaces their first record in the start and the end log respectively.
+    """
+    first_start = _first_datetimes(stats.timed('read/parse logs', iter_log_records(startlog_file)))
+    first_end = _first_datetimes(stats.timed('read/parse logs', iter_log_records(endlog_file)))
+    start_replacements = {}
+    end_replacements = {}
+    for code, start_datetime in first_start.items():
+        end_datetime = first_end.get(code)
+        if end_datetime is not None and start_datetime > end_datetime:
+            start_replacements[code] = end_datetime
+            end_replacements[code] = start_datetime
+    return start_replacements, end_replacements
+
+
+def _replace_first(records, replacements):
+    """Second pass: yield the records with the first datetime of every code in replacements replaced."""
+    pending = dict(replacements)
+    for code, data_time in records:
+        if code in pending:
+            data_time = pending.pop(code)
+        yield code, data_time
+
+
+def _upsert_drivers(drivers, session=None):
+    """
+    Insert or update drivers in batches with ON CONFLICT, return a code -> id map.
+
+    Without a session the name and team of DriverModel are updated (ON CONFLICT on
+    the unique code). The drivers of a session are only added to DriverModel if
+    their code is new; their name and team are upserted into SessionDriverModel, so
+    the other sessions and the single race keep theirs.
+    """
+    if session is None:
+        for batch in chunked(drivers.values(), BATCH_SIZE):
+            (DriverModel
+             .insert_many(batch)
+             .on_conflict(conflict_target=[DriverModel.code],
+                          preserve=[DriverModel.name, DriverModel.team])
+             .execute())
+        _refresh_standing_drivers()
+    else:
+        for batch in chunked(drivers.values(), BATCH_SIZE):
+            DriverModel.insert_many(batch).on_conflict_ignore().execute()
+    driver_ids = {code: driver_id for driver_id, code in
+                  DriverModel.select(DriverModel.id, DriverModel.code).tuples()}
+    if session is not None:
+        rows = ({'session': session, 'driver': driver_ids[driver['code']],
+                 'name': driver['name'], 'team': driver['team']} for driver in drivers.values())
+        for batch in chunked(rows, BATCH_SIZE):
+            (SessionDriverModel
+             .insert_many(batch)
+             .on_conflict(conflict_target=[SessionDriverModel.session, SessionDriverModel.driver],
+                          preserve=[SessionDriverModel.name, SessionDriverModel.team])
+             .execute())
+    return driver_ids
+
+
+def _insert_logs(model, records, driver_ids, session=None):
+    """
+    Insert log records in batches, skipping the (driver, datetime) pairs that are already stored.
+
+    Returns:
+        int: The number of records, including the skipped ones.
+    """
+    rows = ({'driver': driver_ids[code], 'datetime': data_time, 'session': session}
+            for code, data_time in records)
+    count = 0
+    for batch in chunked(rows, BATCH_SIZE):
+        model.insert_many(batch).on_conflict_ignore().execute()
+        count += len(batch)
+    return count
+
+
+def log_offset_key(file_path):
+    """Return the MetaModel key of the '<inode>:<offset>' up to which a log of the single race is stored."""
+    return f'follow.{Path(file_path).name}'
+
+
+def _data_files(data_dir=None):
+    """Return the (abbreviations, start log, end log) paths of a data directory, DATA_DIR by default."""
+    if data_dir is None:
+        return ABBR_FILE, STARTLOG_FILE, ENDLOG_FILE
+    data_dir = Path(data_dir)
+    return (data_dir / ABBR_FILE.name, data_dir / STARTLOG_FILE.name,
+            data_dir / ENDLOG_FILE.name)
+
+
+def store_data_from_files_to_db(data_dir=None, session=None, stats=None):
     """
     Read data from files and store it in the database.
 
     This function reads abbreviation, start log, and end log data from respective files.
-    It then populates the database with this data, ensuring that drivers and their logs
-    are correctly stored. If a driver already exists, their information is updated.
-    It also ensures that the start and end times are correctly ordered by swapping if necessary.
+    The logs are streamed (see iter_log_records) and never held in memory as a whole:
+    a first pass finds the drivers whose first start is after their first end (see
+    _swap_replacements), a second pass swaps those two times while the records are
+    written with batched inserts of BATCH_SIZE rows. If a driver already exists, their
+    information is updated (ON CONFLICT on the unique code; for a session only its
+    own SessionDriverModel rows, see _upsert_drivers); log entries that are
+    already stored are skipped by the unique (driver, datetime) index. The data
+    generation (see get_generation) is increased in the same transaction.
+
+    For the single race (no session) the sizes of the logs are stored as the offsets
+    of follower.LogFollower, which then reads only the lines appended afterwards:
+    the raw lines of the swapped drivers would otherwise be stored next to the
+    corrected ones.
 
     Reads data from:
         - ABBR_FILE: Contains driver abbreviations, names, and teams.
@@ -172,40 +1027,270 @@ def store_data_from_files_to_db():
 
     Uses transactions to ensure atomicity, rolling back if any error occurs.
 
+    Args:
+        data_dir (Path, optional): Read the files with the same names from this
+                                   directory instead of DATA_DIR.
+        session (int, optional): The id of the SessionModel the logs belong to.
+        stats (profiling.IngestStats, optional): Receives the time and row count of
+                                                 every stage of the import.
+
+    Returns:
+        bool: True if the data was stored, False if the transaction was rolled back.
+
     Raises:
         Exception: If any error occurs during the database operations, the transaction is rolled back
                    and the error message is printed.
     """
-    abbr_data = read_data_file(ABBR_FILE)
-    start_data = read_data_file(STARTLOG_FILE)
-    end_data = read_data_file(ENDLOG_FILE)
-    with db.atomic() as transaction:
+    stats = stats or NO_STATS
+    abbr_file, startlog_file, endlog_file = _data_files(data_dir)
+    # Размеры до чтения: строки, дописанные во время импорта, прочитает LogFollower
+    offsets = {} if session is not None else {
+        log_file: f'{log_file.stat().st_ino}:{log_file.stat().st_size}'
+        for log_file in (startlog_file, endlog_file)}
+    # Время вне вложенных этапов - это начало и фиксация транзакции
+    with stats.stage('transaction'), get_database().atomic() as transaction:
         try:
-            drivers = {}
-            for abbr in abbr_data:
-                code, name, team = abbr.split('_', 2)
-                driver, created = DriverModel.get_or_create(
-                    code=code, defaults={'name': name, 'team': team})
-                if not created:
-                    driver.name = name
-                    driver.team = team
-                    driver.save()
-                drivers[code] = driver
-            for start_time in start_data:
-                code = start_time[:3]
-                data_time = datetime.strptime(start_time[3:], DATETIME_FORMAT)
-                if not StartLogModel.get_or_none(
-                        driver=drivers[code], datetime=data_time):
-                    StartLogModel.create(
-                        driver=drivers[code], datetime=data_time)
-            for end_time in end_data:
-                code = end_time[:3]
-                data_time = datetime.strptime(end_time[3:], DATETIME_FORMAT)
-                if not EndLogModel.get_or_none(
-                        driver=drivers[code], datetime=data_time):
-                    EndLogModel.create(
-                        driver=drivers[code], datetime=data_time)
-                swap_times(code)
+            with stats.stage('read abbreviations') as stage:
+                lines = read_data_file(abbr_file)
+                stage.rows += len(lines)
+            with stats.stage('parse abbreviations', len(lines)):
+                drivers = parse_abbreviations(lines)
+            # Разбор логов при первом проходе учитывается в 'read/parse logs'
+            with stats.stage('swap correction'):
+                start_replacements, end_replacements = _swap_replacements(startlog_file,
+                                                                          endlog_file, stats)
+            with stats.stage('driver upsert', len(drivers)):
+                driver_ids = _upsert_drivers(drivers, session)
+            for model, log_file, replacements in (
+                    (StartLogModel, startlog_file, start_replacements),
+                    (EndLogModel, endlog_file, end_replacements)):
+                # Чтение и разбор строк идут во время вставки, их время учитывается отдельно
+                records = stats.timed('read/parse logs', iter_log_records(log_file))
+                with stats.stage('log insert') as stage:
+                    stage.rows += _insert_logs(model, _replace_first(records, replacements),
+                                               driver_ids, session)
+            for log_file, offset in offsets.items():
+                set_meta(log_offset_key(log_file), offset)
+            bump_generation()
         except Exception as e:
             transaction.rollback()
             print(f"Error saving data {e}")
+            return False
+    return True
+
+
+def parse_data_file(file_path):
+    """
+    Read and parse one data file.
+
+    The abbreviations file is parsed with parse_abbreviations, the logs with
+    parse_log. This is a module-level function so it can run in a worker process
+    (see ingest_sessions).
+
+    Args:
+        file_path (Path): The abbreviations file or a start/end log.
+
+    Returns:
+        dict | list: The drivers of the abbreviations file, or the (code, datetime)
+                     records of a log.
+    """
+    if Path(file_path).name == ABBR_FILE.name:
+        return parse_abbreviations(read_data_file(file_path))
+    return list(iter_log_records(file_path))
+
+
+def _store_parsed(drivers, start_records, end_records, session=None, stats=NO_STATS):
+    """Swap out-of-order times, write drivers and logs and bump the generation; run inside a transaction."""
+    with stats.stage('swap correction'):
+        swap_records(start_records, end_records)
+    with stats.stage('driver upsert', len(drivers)):
+        driver_ids = _upsert_drivers(drivers, session)
+    with stats.stage('log insert', len(start_records) + len(end_records)):
+        _insert_logs(StartLogModel, start_records, driver_ids, session)
+        _insert_logs(EndLogModel, end_records, driver_ids, session)
+    bump_generation()
+
+
+def source_fingerprint(use_hash=False):
+    """
+    Build a fingerprint of the source data files.
+
+    Args:
+        use_hash (bool): Use the SHA-256 of the file contents instead of the size and
+                         modification time of the files.
+
+    Returns:
+        str: A string that changes whenever one of ABBR_FILE, STARTLOG_FILE or
+             ENDLOG_FILE changes.
+    """
+    parts = []
+    for file_path in (ABBR_FILE, STARTLOG_FILE, ENDLOG_FILE):
+        if use_hash:
+            parts.append(f"{file_path.name}:{hashlib.sha256(file_path.read_bytes()).hexdigest()}")
+        else:
+            stat = file_path.stat()
+            parts.append(f"{file_path.name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return ';'.join(parts)
+
+
+def import_data(only_if_changed=False, use_hash=False, stats=None):
+    """
+    Import the source data files and recompute the result times.
+
+    The fingerprint of the imported files (see source_fingerprint) is stored in
+    MetaModel only when both the import and the result update succeeded, so a failed
+    run is repeated by the next import with only_if_changed.
+
+    Args:
+        only_if_changed (bool): Skip the import when the fingerprint of the files
+                                equals the one stored by the previous import.
+        use_hash (bool): Compare file contents instead of size and modification time.
+        stats (profiling.IngestStats, optional): Receives the time and row count of
+                                                 every stage, see store_data_from_files_to_db.
+
+    Returns:
+        bool: True if the data was imported, False if it was skipped or failed.
+    """
+    stats = stats or NO_STATS
+    with stats.stage('fingerprint'):
+        fingerprint = source_fingerprint(use_hash)
+        if only_if_changed and get_meta('source_fingerprint') == fingerprint:
+            return False
+    if not store_data_from_files_to_db(stats=stats):
+        return False
+    with stats.stage('result recompute'):
+        if not result_update():
+            return False
+        set_meta('source_fingerprint', fingerprint)
+    return True
+
+
+def find_session_dirs(root):
+    """
+    Find the session folders below root.
+
+    A session folder contains the three data files (abbreviations.txt, start.log and
+    end.log). The race of a session is the path of its parent folder relative to root,
+    or the name of root itself for folders directly inside it, e.g.
+    root/2018-monaco/qualifying -> ('2018-monaco', 'qualifying').
+
+    Args:
+        root (Path): The folder to search recursively.
+
+    Returns:
+        list: (race, session name, folder) tuples sorted by folder.
+    """
+    root = Path(root)
+    sessions = []
+    for abbr_file in sorted(root.rglob(ABBR_FILE.name)):
+        folder = abbr_file.parent
+        if not all(path.exists() for path in _data_files(folder)):
+            continue
+        relative = folder.parent.relative_to(root).as_posix() if folder != root else '.'
+        race = root.name if relative == '.' else relative
+        sessions.append((race, folder.name, folder))
+    return sessions
+
+
+def store_sessions_from_dir(root):
+    """
+    Import every session folder below root and recompute the session results.
+
+    Each folder found by find_session_dirs is stored as a SessionModel (created on the
+    first import), its logs are stored with that session and its results are written
+    to ResultModel.
+
+    Args:
+        root (Path): The folder with the session folders.
+
+    Returns:
+        list: The ids of the sessions that were imported successfully.
+    """
+    return ingest_sessions(root, workers=1)['sessions']
+
+
+def ingest_sessions(root, workers=None, stats=None):
+    """
+    Import every session folder below root, parsing the files in a process pool.
+
+    Every data file is parsed by parse_data_file in its own task of a
+    ProcessPoolExecutor. The calling process is the only writer: it takes the
+    parsed files session by session (in find_session_dirs order), stores them in
+    one transaction with batched inserts and recomputes the session results, so
+    the database sees the same writes as a serial import. The files of at most
+    one session per worker are submitted ahead of the session being written, so
+    the parsed records held in memory do not grow with the number of sessions.
+
+    Args:
+        root (Path): The folder with the session folders.
+        workers (int, optional): The number of worker processes, os.cpu_count() by
+                                 default. With 1 the files are parsed in this process.
+        stats (profiling.IngestStats, optional): Receives the time and row count of
+                                                 every stage; with worker processes
+                                                 'read/parse files' is the time spent
+                                                 waiting for them.
+
+    Returns:
+        dict: Import statistics:
+            - sessions (list): The ids of the sessions imported successfully.
+            - files (int): The number of files parsed successfully.
+            - rows (int): The number of parsed drivers and log records.
+            - seconds (float): The wall time of the import.
+            - rows_per_second (float): rows / seconds.
+    """
+    stats = stats or NO_STATS
+    started = time.perf_counter()
+    folders = find_session_dirs(root)
+    executor = None if workers == 1 else ProcessPoolExecutor(max_workers=workers)
+    # Окно сессий, отправленных в пул заранее: столько разобранных сессий ждут записи
+    window = (workers or os.cpu_count() or 1) if executor is not None else 0
+    futures = {}
+
+    def submit(index):
+        if index < len(folders):
+            futures[index] = [executor.submit(parse_data_file, file_path)
+                              for file_path in _data_files(folders[index][2])]
+
+    for index in range(window):
+        submit(index)
+    imported = []
+    rows = 0
+    files = 0
+    try:
+        for index, (race, name, folder) in enumerate(folders):
+            session = None
+            if executor is not None:
+                pending = futures.pop(index)
+                submit(index + window)
+            with get_database().atomic() as transaction:
+                try:
+                    with stats.stage('read/parse files') as stage:
+                        parsed = []
+                        if executor is None:
+                            for file_path in _data_files(folder):
+                                parsed.append(parse_data_file(file_path))
+                                files += 1
+                        else:
+                            for future in pending:
+                                parsed.append(future.result())
+                                files += 1
+                        drivers, start_records, end_records = parsed
+                        stage.rows += len(drivers) + len(start_records) + len(end_records)
+                    rows += len(drivers) + len(start_records) + len(end_records)
+                    session, _ = SessionModel.get_or_create(race=race, name=name)
+                    _store_parsed(drivers, start_records, end_records, session.id, stats)
+                except Exception as e:
+                    transaction.rollback()
+                    print(f"Error saving session {race}/{name}: {e}")
+                    session = None
+            if session is not None:
+                with stats.stage('result recompute'):
+                    updated = result_update(session=session.id)
+                if updated:
+                    imported.append(session.id)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    seconds = time.perf_counter() - started
+    return {'sessions': imported, 'files': files, 'rows': rows, 'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds else 0.0}
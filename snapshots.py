@@ -0,0 +1,187 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import Response, request, url_for
+from peewee import DoesNotExist
+import report_cache
+import report_racers
+from metrics import registry
+from renders import RENDERS
+
+ORDERS = ('asc', 'desc')
+# Сколько наборов ссылок (по URL root запроса, т.е. по заголовку Host) хранится одновременно
+MAX_URL_ROOTS = 8
+
+
+class Snapshot:
+    """
+    A pre-rendered response body with a strong ETag.
+
+    Attributes:
+        body (bytes): The serialized body.
+        mimetype (str): The mimetype of the body.
+        etag (str): The SHA-1 of the body, used as a strong ETag.
+    """
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+
+    def response(self):
+        """Return the body as a response for the current request, 304 if If-None-Match matches."""
+        response = Response(self.body, mimetype=self.mimetype)
+        response.set_etag(self.etag)
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+def driver_link(racer, session=None):
+    """Return a copy of the racer with the code replaced by the URL of their NamePage resource."""
+    return dict(racer, code=url_for('namepage', name=racer['code'], session=session,
+                                    _external=True))
+
+
+def driver_links(sorted_data):
+    """Apply driver_link to every racer."""
+    return [driver_link(racer) for racer in sorted_data]
+
+
+def build_snapshots():
+    """
+    Render every API body of the current data generation that does not depend on the host.
+
+    Returns:
+        dict: Mapping of (resource, order or code, format) to Snapshot:
+            - ('report', order, format): IndexApi bodies.
+            - ('racer', code, format): NamePage bodies.
+    """
+    snapshots = {}
+    for order in ORDERS:
+        sorted_data = report_cache.get_all_racer(order)
+        for format_name, render_class in RENDERS.items():
+            render_ = render_class()
+            snapshots[('report', order, format_name)] = Snapshot(
+                render_.dumps(sorted_data), render_.mimetype)
+            if order == 'asc':
+                for racer in sorted_data:
+                    snapshots[('racer', racer['code'], format_name)] = Snapshot(
+                        render_.dumps([racer]), render_.mimetype)
+    return snapshots
+
+
+def build_driver_snapshots():
+    """
+    Render the InfoDriver bodies, ('drivers', order, format) -> Snapshot.
+
+    Must be called within a request context, the driver links are built for the
+    URL root of the current request.
+    """
+    snapshots = {}
+    for order in ORDERS:
+        linked = driver_links(report_cache.get_all_racer(order))
+        for format_name, render_class in RENDERS.items():
+            render_ = render_class()
+            snapshots[('drivers', order, format_name)] = Snapshot(
+                render_.dumps(linked), render_.mimetype)
+    return snapshots
+
+
+def session_snapshot(resource, key, format_name, session):
+    """
+    Render one body of a session on demand.
+
+    Only the single race is pre-rendered by build_snapshots; the bodies of a session
+    are rendered on the first request and cached by report_cache until the next data
+    change.
+
+    Args:
+        resource (str): 'report', 'drivers' or 'racer', see SnapshotStore.get.
+        key (str): The sort order, or the driver code for 'racer'.
+        format_name (str): One of the keys of RENDERS.
+        session (int): The id of the SessionModel.
+
+    Returns:
+        Snapshot: The rendered body, or None if the driver has no result in the session.
+    """
+    def build():
+        render_ = RENDERS[format_name]()
+        if resource == 'racer':
+            try:
+                data = report_cache.get_racer_by_code(key, session)
+            except DoesNotExist:
+                return None
+        else:
+            data = report_cache.get_all_racer(key, session)
+            if resource == 'drivers':
+                data = [driver_link(racer, session) for racer in data]
+        return Snapshot(render_.dumps(data), render_.mimetype)
+
+    # Только тела 'drivers' содержат абсолютные ссылки и зависят от хоста
+    url_root = request.url_root if resource == 'drivers' else None
+    return report_cache.cached(
+        ('snapshot', resource, key, format_name, session, url_root), build)
+
+
+class SnapshotStore:
+    """
+    Process-local store of the snapshots of the current data generation.
+
+    The snapshots are rebuilt on the first request after the data generation (see
+    report_racers.get_generation) has changed, i.e. after every import or result
+    update. Until then the stored bytes are served as they are.
+
+    The 'report' and 'racer' bodies are the same for every client and stored once.
+    The 'drivers' bodies contain absolute links built from the Host header of the
+    request, so they are stored per URL root, for the MAX_URL_ROOTS most recently
+    used ones: clients sending arbitrary Host values cannot grow the store.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._snapshots = None
+        self._links = OrderedDict()
+
+    def get(self, key):
+        """
+        Return the snapshot stored under key for the current request.
+
+        Args:
+            key (tuple): (resource, order or code, format), see build_snapshots and
+                         build_driver_snapshots.
+
+        Returns:
+            Snapshot: The snapshot, or None if there is no such body.
+        """
+        generation = report_racers.get_generation()
+        with self._lock:
+            if generation != self._generation:
+                self._snapshots = None
+                self._links.clear()
+                self._generation = generation
+            if key[0] != 'drivers':
+                registry.record_cache('snapshot', self._snapshots is not None)
+                if self._snapshots is None:
+                    self._snapshots = build_snapshots()
+                return self._snapshots.get(key)
+            url_root = request.url_root
+            links = self._links.get(url_root)
+            registry.record_cache('snapshot', links is not None)
+            if links is None:
+                links = self._links[url_root] = build_driver_snapshots()
+                while len(self._links) > MAX_URL_ROOTS:
+                    self._links.popitem(last=False)
+            else:
+                self._links.move_to_end(url_root)
+            return links.get(key)
+
+    def clear(self):
+        """Drop all snapshots, they are rebuilt on the next request."""
+        with self._lock:
+            self._generation = None
+            self._snapshots = None
+            self._links.clear()
+
+
+store = SnapshotStore()
@@ -1,14 +1,34 @@
-from datetime import datetime
+import asyncio
+from datetime import datetime, timedelta
+import json
+import shutil
+import tempfile
+import threading
+import time
 
 import unittest
 from unittest.mock import mock_open, patch
 from pathlib import Path
 
-from peewee import SqliteDatabase
+from peewee import DoesNotExist, OperationalError, PostgresqlDatabase, SqliteDatabase
+from playhouse.pool import PooledSqliteDatabase
 
+from follower import LogFollower
+import asgi
+from benchmarks.synthetic import generate_data
+import db
+import live
+import metrics
+import migrations
+import profiling
+from profiling import IngestStats
+import report_cache
 import report_racers
-from main import app
-from db import DriverModel, StartLogModel, EndLogModel
+import snapshots
+import timeparse
+from main import app, create_app
+from db import (DriverModel, StartLogModel, EndLogModel, MetaModel, SessionModel,
+                ResultModel, SessionDriverModel, StandingModel, CrossingModel, MODELS)
 
 import xml.etree.ElementTree as ET
 from lxml import etree
@@ -17,19 +37,57 @@ from lxml import etree
 test_db = SqliteDatabase(':memory:')
 
 
+def make_sessions_dir():
+    """Copy the data folder into root/monaco/race and root/monaco/qualifying."""
+    root = Path(tempfile.mkdtemp())
+    for name in ('race', 'qualifying'):
+        shutil.copytree(report_racers.DATA_DIR, root / 'monaco' / name)
+    # Квалификация на день раньше, время круга на минуту больше
+    qualifying = root / 'monaco' / 'qualifying'
+    for log_name, shift in (('start.log', timedelta(days=-1)),
+                            ('end.log', timedelta(days=-1, minutes=1))):
+        path = qualifying / log_name
+        lines = []
+        for line in path.read_text().splitlines():
+            if not line.strip():
+                continue
+            moment = datetime.strptime(line[3:].strip(), report_racers.DATETIME_FORMAT)
+            moment += shift
+            lines.append(line[:3] + moment.strftime(report_racers.DATETIME_FORMAT)[:-3])
+        path.write_text('\n'.join(lines) + '\n')
+    return root
+
+
+def call_asgi(asgi_app, path, query='', headers=(), method='GET'):
+    """Run one request through an ASGI application, return (status, headers, body)."""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'scheme': 'http', 'root_path': '',
+             'query_string': query.encode(), 'headers': [(b'host', b'localhost'), *headers]}
+    asyncio.run(asgi_app(scope, receive, send))
+    start, body = messages
+    return (start['status'], {key.decode(): value.decode() for key, value in start['headers']},
+            body['body'])
+
+
 class TestDataFromFileToDb(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        test_db.bind([DriverModel, StartLogModel, EndLogModel],
-                     bind_refs=False, bind_backrefs=False)
+        test_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
         test_db.connect()
-        test_db.create_tables([DriverModel, StartLogModel, EndLogModel])
+        test_db.create_tables(MODELS)
 
     @classmethod
     def tearDownClass(cls):
         # Закрываем соединение с тестовой базой данных и удаляем таблицы
-        test_db.drop_tables([DriverModel, StartLogModel, EndLogModel])
+        test_db.drop_tables(MODELS)
         test_db.close()
 
     def setUp(self):
@@ -53,9 +111,15 @@ class TestDataFromFileToDb(unittest.TestCase):
 
     def tearDown(self):
         # Очищаем таблицы после каждого теста
+        ResultModel.delete().execute()
+        SessionDriverModel.delete().execute()
+        StandingModel.delete().execute()
+        CrossingModel.delete().execute()
         DriverModel.delete().execute()
         StartLogModel.delete().execute()
         EndLogModel.delete().execute()
+        SessionModel.delete().execute()
+        MetaModel.delete().execute()
 
     def test_store_data_from_files_to_db(self):
         drivers = DriverModel.select()
@@ -83,6 +147,54 @@ class TestDataFromFileToDb(unittest.TestCase):
         self.assertEqual(start_log.datetime, datetime(2023, 1, 1, 12, 0, 0))
         self.assertEqual(end_log.datetime, datetime(2023, 1, 1, 12, 2, 0))
 
+    def test_swap_records(self):
+        start_records = [('DR1', datetime(2023, 1, 1, 12, 2, 0)),
+                         ('DR2', datetime(2023, 1, 1, 12, 0, 0))]
+        end_records = [('DR1', datetime(2023, 1, 1, 12, 0, 0)),
+                       ('DR2', datetime(2023, 1, 1, 12, 1, 0))]
+
+        report_racers.swap_records(start_records, end_records)
+
+        self.assertEqual(start_records[0][1], datetime(2023, 1, 1, 12, 0, 0))
+        self.assertEqual(end_records[0][1], datetime(2023, 1, 1, 12, 2, 0))
+        self.assertEqual(start_records[1][1], datetime(2023, 1, 1, 12, 0, 0))
+        self.assertEqual(end_records[1][1], datetime(2023, 1, 1, 12, 1, 0))
+
+    def test_store_data_from_files_to_db_bulk(self):
+        report_racers.store_data_from_files_to_db()
+        counts = (DriverModel.select().count(),
+                  StartLogModel.select().count(),
+                  EndLogModel.select().count())
+        # Повторный импорт не должен дублировать записи
+        report_racers.store_data_from_files_to_db()
+        self.assertEqual(counts, (DriverModel.select().count(),
+                                  StartLogModel.select().count(),
+                                  EndLogModel.select().count()))
+        self.assertEqual(counts, (21, 21, 21))
+        start_log = StartLogModel.get(
+            StartLogModel.driver == DriverModel.get(DriverModel.code == 'DRR'))
+        end_log = EndLogModel.get(EndLogModel.driver == start_log.driver)
+        self.assertLess(start_log.datetime, end_log.datetime)
+
+    def test_import_data_only_if_changed(self):
+        self.assertTrue(report_racers.import_data(only_if_changed=True))
+        self.assertEqual(report_racers.get_meta('source_fingerprint'),
+                         report_racers.source_fingerprint())
+        # Файлы не менялись - повторный импорт пропускается
+        self.assertFalse(report_racers.import_data(only_if_changed=True))
+        self.assertTrue(report_racers.import_data(only_if_changed=True, use_hash=True))
+        self.assertTrue(report_racers.import_data())
+
+    def test_import_data_failed_result_update(self):
+        with patch('report_racers.rebuild_standings', side_effect=RuntimeError('boom')), \
+                patch('builtins.print') as print_mock:
+            self.assertFalse(report_racers.import_data(only_if_changed=True))
+        print_mock.assert_called_once()
+        self.assertIsNone(report_racers.get_meta('source_fingerprint'))
+        # Неудачный импорт повторяется, а не пропускается
+        self.assertTrue(report_racers.import_data(only_if_changed=True))
+        self.assertEqual(len(report_racers.get_all_racer('asc')), DriverModel.select().count())
+
     def test_result_update(self):
         report_racers.result_update()
         drivers = DriverModel.select()
@@ -91,6 +203,25 @@ class TestDataFromFileToDb(unittest.TestCase):
                 driver.result_time,
                 "Результатное время должно быть обновлено")
 
+    def test_result_update_incremental(self):
+        report_racers.result_update()
+        driver3 = DriverModel.create(
+            code='DR3', name='Driver Three', team='Team A')
+        StartLogModel.create(
+            driver=driver3, datetime=datetime(2023, 1, 1, 12, 0, 0))
+        EndLogModel.create(
+            driver=driver3, datetime=datetime(2023, 1, 1, 12, 0, 30, 500))
+        DriverModel.update(result_time=None).where(
+            DriverModel.id == self.driver1.id).execute()
+
+        report_racers.result_update(incremental=True)
+
+        # Пересчитывается только водитель с новыми записями
+        self.assertIsNone(DriverModel.get_by_id(self.driver1.id).result_time)
+        self.assertEqual(
+            DriverModel.get_by_id(driver3.id).result_time.strftime('%H:%M:%S.%f'),
+            '00:00:30.000500')
+
     def test_get_all_racer(self):
         report_racers.result_update()
         racers = report_racers.get_all_racer('asc')
@@ -111,6 +242,550 @@ class TestDataFromFileToDb(unittest.TestCase):
             driver.code,
             "Код водителя должен совпадать")
 
+    def test_store_sessions_from_dir(self):
+        root = make_sessions_dir()
+        self.addCleanup(shutil.rmtree, root)
+        self.assertTrue(report_racers.import_data())
+        sessions = report_racers.store_sessions_from_dir(root)
+        self.assertEqual(len(sessions), 2)
+        self.assertEqual([(item['race'], item['name']) for item in report_racers.get_sessions()],
+                         [('monaco', 'qualifying'), ('monaco', 'race')])
+        race, qualifying = (SessionModel.get(name=name).id for name in ('race', 'qualifying'))
+        legacy = [racer for racer in report_racers.get_all_racer('asc')
+                  if racer['code'] not in ('DR1', 'DR2')]
+        self.assertEqual(report_racers.get_all_racer('asc', race), legacy)
+        self.assertEqual(report_racers.get_racer_by_code('SVF', qualifying)[0]['result_time'],
+                         '00:02:04.415000')
+        # Повторный импорт не создает новых сессий и записей
+        session_logs = StartLogModel.select().where(StartLogModel.session.is_null(False))
+        counts = (ResultModel.select().count(), session_logs.count())
+        self.assertEqual(report_racers.store_sessions_from_dir(root), sessions)
+        self.assertEqual(SessionModel.select().count(), 2)
+        self.assertEqual(counts, (ResultModel.select().count(), session_logs.count()))
+        self.assertEqual(counts[1], 19 * 2)
+
+    def test_sessions_keep_their_drivers(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root)
+        self.assertTrue(report_racers.import_data())
+        for season in ('2018-monaco', '2019-monaco'):
+            shutil.copytree(report_racers.DATA_DIR, root / season / 'race')
+        abbreviations = root / '2019-monaco' / 'race' / 'abbreviations.txt'
+        abbreviations.write_text(abbreviations.read_text().replace(
+            'SVF_Sebastian Vettel_FERRARI', 'SVF_Sebastian Vettel_ASTON MARTIN'))
+        old, new = report_racers.store_sessions_from_dir(root)
+        self.assertEqual(report_racers.get_racer_by_code('SVF', old)[0]['team'], 'FERRARI')
+        self.assertEqual(report_racers.get_racer_by_code('SVF', new)[0]['team'], 'ASTON MARTIN')
+        self.assertEqual(report_racers.get_racer_by_code('SVF')[0]['team'], 'FERRARI')
+        self.assertEqual(report_racers.get_laps('SVF', old)['team'], 'FERRARI')
+        self.assertEqual(report_racers.get_team('FERRARI', old)['drivers'], 2)
+        self.assertEqual(report_racers.get_team('FERRARI', new)['drivers'], 1)
+
+    def test_driver_import_keeps_session_standings(self):
+        root = make_sessions_dir()
+        self.addCleanup(shutil.rmtree, root)
+        abbreviations = root / 'monaco' / 'qualifying' / 'abbreviations.txt'
+        abbreviations.write_text(abbreviations.read_text().replace(
+            'SVF_Sebastian Vettel_FERRARI', 'SVF_Sebastian Vettel_ASTON MARTIN'))
+        qualifying, race = report_racers.store_sessions_from_dir(root)
+        teams = [report_racers.get_teams(session) for session in (qualifying, race)]
+        # Импорт единственной гонки с другой командой обновляет только ее таблицу
+        data_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, data_dir)
+        for path in report_racers._data_files():
+            shutil.copy(path, data_dir)
+        abbreviations = data_dir / 'abbreviations.txt'
+        abbreviations.write_text(abbreviations.read_text().replace(
+            'SVF_Sebastian Vettel_FERRARI', 'SVF_Sebastian Vettel_WILLIAMS'))
+        self.assertTrue(report_racers.store_data_from_files_to_db(data_dir))
+        report_racers.result_update()
+        self.assertEqual(report_racers.get_racer_by_code('SVF')[0]['team'], 'WILLIAMS')
+        self.assertEqual(report_racers.get_racer_by_code('SVF', qualifying)[0]['team'], 'ASTON MARTIN')
+        self.assertEqual(report_racers.get_racer_by_code('SVF', race)[0]['team'], 'FERRARI')
+        self.assertEqual([report_racers.get_teams(session) for session in (qualifying, race)], teams)
+        self.assertEqual(report_racers.get_team('FERRARI', race)['drivers'], 2)
+
+    def test_ingest_sessions_parallel(self):
+        root = make_sessions_dir()
+        self.addCleanup(shutil.rmtree, root)
+        # Сессия с нечитаемым end.log: два ее файла разобраны, третий нет
+        broken = root / 'monaco' / 'broken'
+        shutil.copytree(report_racers.DATA_DIR, broken)
+        (broken / 'end.log').unlink()
+        (broken / 'end.log').mkdir()
+        stats = report_racers.ingest_sessions(root, workers=2)
+        self.assertEqual(len(stats['sessions']), 2)
+        self.assertEqual((stats['files'], stats['rows']), (8, 19 * 3 * 2))
+        self.assertGreater(stats['rows_per_second'], 0)
+        parallel = [report_racers.get_all_racer('asc', session) for session in stats['sessions']]
+        ResultModel.delete().execute()
+        self.assertEqual(report_racers.ingest_sessions(root, workers=1)['sessions'],
+                         stats['sessions'])
+        self.assertEqual(parallel, [report_racers.get_all_racer('asc', session)
+                                    for session in stats['sessions']])
+
+    def test_iter_log_records(self):
+        for log_file in (report_racers.STARTLOG_FILE, report_racers.ENDLOG_FILE):
+            self.assertEqual(list(report_racers.iter_log_records(log_file)),
+                             report_racers.parse_log(report_racers.read_data_file(log_file)))
+        folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, folder)
+        empty = folder / 'empty.log'
+        empty.write_bytes(b'')
+        self.assertEqual(list(report_racers.iter_log_records(empty)), [])
+        spaced = folder / 'spaced.log'
+        spaced.write_bytes(b'SVF2018-05-24_12:02:58.917  \r\n\n   \nNHR2018-05-24_12:02:49.914')
+        self.assertEqual([code for code, _ in report_racers.iter_log_records(spaced)],
+                         ['SVF', 'NHR'])
+        spaced.write_bytes(b'SVF2018-05-24_12:02:58.917\nNHR2018-05-24 12:02:49.914\n')
+        with self.assertRaisesRegex(ValueError, 'spaced.log line 2'):
+            list(report_racers.iter_log_records(spaced))
+
+    def test_store_data_streamed_swap(self):
+        folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, folder)
+        (folder / 'abbreviations.txt').write_text('DR3_Driver Three_Team C\n')
+        (folder / 'start.log').write_text('DR32023-01-02_12:05:00.000\nDR32023-01-02_12:10:00.000\n')
+        (folder / 'end.log').write_text('DR32023-01-02_12:01:00.000\nDR32023-01-02_12:20:00.000\n')
+        start_records = list(report_racers.iter_log_records(folder / 'start.log'))
+        end_records = list(report_racers.iter_log_records(folder / 'end.log'))
+        report_racers.swap_records(start_records, end_records)
+        self.assertTrue(report_racers.store_data_from_files_to_db(folder))
+        driver = DriverModel.get(code='DR3')
+        stored = [[(log.driver.code, log.datetime) for log in
+                   model.select().where(model.driver == driver).order_by(model.id)]
+                  for model in (StartLogModel, EndLogModel)]
+        self.assertEqual(stored, [start_records, end_records])
+        self.assertEqual(stored[0][0][1], datetime(2023, 1, 2, 12, 1, 0))
+
+    def test_standings_materialized(self):
+        self.assertTrue(report_racers.import_data())
+        standings = list(StandingModel.select().where(StandingModel.session.is_null())
+                         .order_by(StandingModel.rank))
+        self.assertEqual([standing.rank for standing in standings], list(range(1, 22)))
+        self.assertEqual([(standing.code, standing.result_time) for standing in standings],
+                         [(racer['code'], racer['result_time'])
+                          for racer in report_racers.get_all_racer('asc')])
+        # Переименование гонщика при импорте сразу попадает в таблицу результатов
+        report_racers._upsert_drivers({'SVF': {'code': 'SVF', 'name': 'S. Vettel', 'team': 'FERRARI'}})
+        self.assertEqual(report_racers.get_racer_by_code('SVF')[0]['name'], 'S. Vettel')
+
+    def test_crossing_laps(self):
+        folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, folder)
+        generate_data(folder, drivers=4, laps=3, seed=5, swapped=0)
+        session = SessionModel.create(race='synthetic', name='race').id
+        self.assertTrue(report_racers.store_data_from_files_to_db(folder, session))
+        report_racers.result_update(session=session)
+        # 3 круга - 4 пересечения линии на гонщика
+        self.assertEqual(CrossingModel.select().where(CrossingModel.session == session).count(), 16)
+        racers = report_racers.get_all_racer('asc', session)
+        for racer in racers:
+            laps = report_racers.get_laps(racer['code'], session)
+            self.assertEqual([lap['lap'] for lap in laps['laps']], [1, 2, 3])
+            self.assertEqual(laps['laps'][-1]['elapsed'], racer['result_time'])
+            self.assertEqual(laps['best_lap'], min(lap['lap_time'] for lap in laps['laps']))
+            self.assertEqual([lap['best'] for lap in laps['laps']].count(True), 1)
+        leader = report_racers.get_laps(racers[0]['code'], session)['laps'][-1]
+        self.assertEqual((leader['position'], leader['gap']), (1, '00:00:00.000000'))
+        last = report_racers.get_laps(racers[-1]['code'], session)['laps'][-1]
+        self.assertEqual(last['position'], 4)
+        with self.assertRaises(DoesNotExist):
+            report_racers.get_laps(racers[0]['code'])
+        with self.assertRaises(DoesNotExist):
+            report_racers.get_laps('XXX', session)
+
+    def test_team_aggregates(self):
+        report_racers.import_data()
+        racers = report_racers.get_all_racer('asc')
+        teams = report_racers.get_teams()
+        self.assertEqual(sum(team['drivers'] for team in teams), len(racers))
+        self.assertEqual(teams[0]['team'], racers[0]['team'])
+        self.assertEqual(teams[0]['best_time'], racers[0]['result_time'])
+        ferrari = report_racers.get_team('FERRARI')
+        self.assertEqual([racer['code'] for racer in ferrari['racers']], ['SVF', 'KRF'])
+        self.assertEqual(ferrari['drivers'], 2)
+        self.assertEqual(ferrari['best_time'], '00:01:04.415000')
+        self.assertEqual(ferrari['total_time'], '00:02:17.054000')
+        self.assertEqual(ferrari['average_time'], '00:01:08.527000')
+        with self.assertRaises(DoesNotExist):
+            report_racers.get_team('NONE')
+
+    def test_synthetic_benchmark_data(self):
+        folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, folder)
+        generate_data(folder, drivers=30, laps=2, seed=3)
+        self.assertEqual(len(report_racers.read_data_file(folder / 'start.log')), 60)
+        self.assertTrue(report_racers.store_data_from_files_to_db(folder))
+        # Ни одна строка не теряется при исправлении перепутанных времен
+        self.assertEqual((StartLogModel.select().count(), EndLogModel.select().count()),
+                         (60 + 2, 60 + 2))
+        report_racers.result_update()
+        self.assertEqual(len(report_racers.get_all_racer('asc')), 32)
+
+    def test_import_stage_stats(self):
+        stats = IngestStats()
+        self.assertTrue(report_racers.import_data(stats=stats))
+        stages = {stage['stage']: stage for stage in stats.as_dict()['stages']}
+        self.assertEqual(list(stages), ['fingerprint', 'transaction', 'read abbreviations',
+                                        'parse abbreviations', 'swap correction',
+                                        'read/parse logs', 'driver upsert', 'log insert',
+                                        'result recompute'])
+        self.assertEqual(stages['driver upsert']['rows'], 19)
+        self.assertEqual(stages['log insert']['rows'], 38)
+        # Оба прохода по логам: поиск перепутанных времен и вставка
+        self.assertEqual(stages['read/parse logs']['rows'], 38 * 2)
+        self.assertAlmostEqual(sum(stage['seconds'] for stage in stages.values()),
+                               stats.seconds)
+        self.assertIn('log insert', stats.format())
+
+    def test_stage_excludes_nested_time(self):
+        stats = IngestStats()
+        with stats.stage('outer'):
+            for _ in stats.timed('inner', [1, 2, 3]):
+                time.sleep(0.01)
+            with stats.stage('nested'):
+                time.sleep(0.02)
+        self.assertEqual(stats.stages['inner'].rows, 3)
+        self.assertGreaterEqual(stats.stages['outer'].seconds, 0.03)
+        self.assertLess(stats.stages['outer'].seconds, 0.05)
+        self.assertGreaterEqual(stats.stages['nested'].seconds, 0.02)
+
+    def test_profiled_writes_pstats(self):
+        folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, folder)
+        with profiling.profiled(str(folder / 'import.prof'), top=5) as summary:
+            report_racers.store_data_from_files_to_db()
+        self.assertIn('store_data_from_files_to_db', summary.getvalue())
+        self.assertTrue((folder / 'import.prof').stat().st_size > 0)
+
+
+class TestTimeParse(unittest.TestCase):
+
+    def test_parse_datetime_matches_strptime(self):
+        for text in ('2018-05-24_12:02:58.917', '2018-05-24_12:02:58.9',
+                     '2018-05-24_12:02:58.91234', '2018-05-24_12:02:58.917123'):
+            self.assertEqual(timeparse.parse_datetime(text),
+                             datetime.strptime(text, report_racers.DATETIME_FORMAT))
+        lines = report_racers.read_data_file(report_racers.STARTLOG_FILE)
+        self.assertEqual(report_racers.parse_log(lines),
+                         [(line[:3], datetime.strptime(line[3:], report_racers.DATETIME_FORMAT))
+                          for line in lines])
+
+    def test_parse_datetime_invalid(self):
+        for text in ('2018-05-24 12:02:58.917', '2018-05-24_12:02:58', '2018-02-30_12:02:58.917',
+                     '2018-05-24_12:02:58.1234567', '２018-05-24_12:02:58.917',
+                     '2018-5-24_1:2:3.9', ''):
+            with self.assertRaises(ValueError):
+                timeparse.parse_datetime(text)
+        with self.assertRaisesRegex(ValueError, 'line 2'):
+            timeparse.parse_log_lines(['SVF2018-05-24_12:02:58.917', 'NHR2018-05-24_12:02'])
+
+
+class TestLogFollower(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        test_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+        test_db.connect()
+        test_db.create_tables(MODELS)
+
+    @classmethod
+    def tearDownClass(cls):
+        test_db.drop_tables(MODELS)
+        test_db.close()
+
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder)
+        shutil.copy(report_racers.ABBR_FILE, self.folder)
+        self.start_lines = report_racers.read_data_file(report_racers.STARTLOG_FILE)
+        self.end_lines = report_racers.read_data_file(report_racers.ENDLOG_FILE)
+        (self.folder / 'start.log').write_text('\n'.join(self.start_lines) + '\n')
+        (self.folder / 'end.log').write_text('')
+        self.follower = LogFollower(self.folder)
+
+    def tearDown(self):
+        StandingModel.delete().execute()
+        CrossingModel.delete().execute()
+        DriverModel.delete().execute()
+        StartLogModel.delete().execute()
+        EndLogModel.delete().execute()
+        MetaModel.delete().execute()
+
+    def append_end(self, text):
+        with open(self.folder / 'end.log', 'a') as fp:
+            fp.write(text)
+
+    def test_poll_appended_lines(self):
+        self.assertEqual(len(self.follower.poll()), 19)
+        self.assertEqual(report_racers.get_all_racer('asc'), [])
+        generation = report_racers.get_generation()
+        self.append_end('\n'.join(self.end_lines[:5]) + '\n' + self.end_lines[5][:10])
+        codes = self.follower.poll()
+        self.assertEqual(codes, {line[:3] for line in self.end_lines[:5]})
+        self.assertEqual(len(report_racers.get_all_racer('asc')), 5)
+        self.assertNotEqual(report_racers.get_generation(), generation)
+        # Незаконченная строка дописывается и читается следующим опросом
+        self.append_end(self.end_lines[5][10:] + '\n' + '\n'.join(self.end_lines[6:]) + '\n')
+        self.assertEqual(len(self.follower.poll()), 14)
+        self.assertEqual(self.follower.poll(), set())
+        self.assertEqual(EndLogModel.select().count(), 19)
+        expected = report_racers.get_all_racer('asc')
+        DriverModel.delete().execute()
+        StartLogModel.delete().execute()
+        EndLogModel.delete().execute()
+        self.assertTrue(report_racers.import_data())
+        self.assertEqual(report_racers.get_all_racer('asc'), expected)
+
+    def test_poll_truncated_and_unknown_driver(self):
+        self.append_end('\n'.join(self.end_lines) + '\n')
+        self.follower.poll()
+        (self.folder / 'end.log').write_text(self.end_lines[0] + '\n')
+        # Перечитанная строка уже сохранена, новых записей нет
+        self.assertEqual(self.follower.poll(), set())
+        self.append_end('XXX2018-05-24_12:04:03.332\n')
+        with patch('builtins.print') as print_mock:
+            self.assertEqual(self.follower.poll(), set())
+        print_mock.assert_called_once()
+        self.assertEqual(EndLogModel.select().count(), 19)
+
+    def test_import_then_follow(self):
+        shutil.copy(report_racers.STARTLOG_FILE, self.folder)
+        shutil.copy(report_racers.ENDLOG_FILE, self.folder)
+        self.assertTrue(report_racers.store_data_from_files_to_db(self.folder))
+        self.assertTrue(report_racers.result_update())
+        expected = report_racers.get_all_racer('asc')
+        # Исправленные импортом строки не добавляются заново в исходном виде
+        self.assertEqual(self.follower.poll(), set())
+        self.assertEqual((StartLogModel.select().count(), EndLogModel.select().count()), (19, 19))
+        self.assertEqual(report_racers.get_all_racer('asc'), expected)
+        code = self.end_lines[0][:3]
+        self.append_end(f'\n{code}2018-05-24_12:20:00.000\n')
+        self.assertEqual(self.follower.poll(), {code})
+        self.assertEqual(EndLogModel.select().count(), 20)
+
+    def test_poll_second_lap_keeps_one_row_per_driver(self):
+        self.append_end('\n'.join(self.end_lines) + '\n')
+        self.follower.poll()
+        code = self.end_lines[0][:3]
+        self.append_end(f'{code}2018-05-24_12:20:00.000\n')
+        self.assertEqual(self.follower.poll(), {code})
+        racers = report_racers.get_all_racer('asc')
+        self.assertEqual(len(racers), 19)
+        self.assertEqual([racer['code'] for racer in racers].count(code), 1)
+
+    def test_incremental_update_matches_rebuild(self):
+        self.append_end('\n'.join(self.end_lines) + '\n')
+        self.follower.poll()
+        codes = [line[:3] for line in self.end_lines[:4]]
+        # Новые круги, одинаковое время прохода и отметка раньше всех остальных
+        self.append_end(f'{codes[0]}2018-05-24_12:20:00.000\n{codes[1]}2018-05-24_12:20:00.000\n'
+                        f'{codes[2]}2018-05-24_12:21:30.500\n{codes[3]}2018-05-24_11:59:00.000\n')
+        self.assertEqual(self.follower.poll(), set(codes))
+
+        def rows():
+            standings = list(StandingModel.select(
+                StandingModel.driver, StandingModel.result_time, StandingModel.rank)
+                .order_by(StandingModel.driver).tuples())
+            crossings = list(CrossingModel.select(
+                CrossingModel.driver, CrossingModel.datetime, CrossingModel.lap,
+                CrossingModel.lap_time, CrossingModel.elapsed, CrossingModel.gap,
+                CrossingModel.position)
+                .order_by(CrossingModel.driver, CrossingModel.lap).tuples())
+            return standings, crossings
+
+        incremental = rows()
+        self.assertEqual(CrossingModel.select().where(CrossingModel.lap == 2).count(), 4)
+        self.assertTrue(report_racers.result_update())
+        self.assertEqual(incremental, rows())
+
+
+class TestAsgiApp(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Запросы выполняются в потоках пула, поэтому база в файле, а не в памяти
+        cls.folder = Path(tempfile.mkdtemp())
+        cls.file_db = SqliteDatabase(str(cls.folder / 'asgi.db'))
+        cls.file_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+        cls.file_db.create_tables(MODELS)
+        report_racers.import_data()
+        cls.asgi_app = asgi.ReportApp()
+        cls.client = app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asgi_app.report.close()
+        cls.file_db.close()
+        shutil.rmtree(cls.folder)
+        test_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+
+    def test_same_bodies_as_flask(self):
+        for path, query in (('/api/v1/report/', 'order=desc&format=xml'),
+                            ('/api/v1/report/drivers/', 'format=json'),
+                            ('/api/v1/report/drivers/SVF/', 'format=ndjson'),
+                            ('/api/v1/report/drivers/SVF/laps/', ''),
+                            ('/api/v1/report/teams/', ''),
+                            ('/api/v1/report/teams/FERRARI/', ''),
+                            ('/api/v1/report/', 'limit=5&after=00:01:12.657000,4'),
+                            ('/api/v1/sessions/', '')):
+            status, headers, body = call_asgi(self.asgi_app, path, query)
+            self.assertEqual(status, 200, path)
+            flask_response = self.client.get(f'{path}?{query}')
+            self.assertEqual(body, flask_response.data, path)
+            self.assertEqual(headers['content-type'].split(';')[0], flask_response.mimetype)
+
+    def test_conditional_and_errors(self):
+        status, headers, _ = call_asgi(self.asgi_app, '/api/v1/report/')
+        status, _, body = call_asgi(self.asgi_app, '/api/v1/report/',
+                                    headers=[(b'if-none-match', headers['etag'].encode())])
+        self.assertEqual((status, body), (304, b''))
+        self.assertEqual(call_asgi(self.asgi_app, '/api/v1/report/', 'order=up')[0], 400)
+        self.assertEqual(call_asgi(self.asgi_app, '/api/v1/report/', 'session=3')[0], 404)
+        self.assertEqual(call_asgi(self.asgi_app, '/api/v1/report/drivers/XXX/')[0], 404)
+        self.assertEqual(call_asgi(self.asgi_app, '/api/v1/report/drivers/XXX/laps/')[0], 404)
+        self.assertEqual(call_asgi(self.asgi_app, '/api/v1/report/teams/NONE/')[0], 404)
+        self.assertEqual(call_asgi(self.asgi_app, '/api/v1/other/')[0], 404)
+        self.assertEqual(call_asgi(self.asgi_app, '/api/v1/report/', method='POST')[0], 405)
+        status, headers, _ = call_asgi(self.asgi_app, '/api/v1/report/drivers/', 'limit=2')
+        self.assertIn('rel="next"', headers['link'])
+
+    def test_bodies_bounded_per_host(self):
+        for number in range(snapshots.MAX_URL_ROOTS + 5):
+            host = f'host{number}.example'
+            _, _, body = call_asgi(self.asgi_app, '/api/v1/report/drivers/',
+                                   headers=[(b'host', host.encode())])
+            self.assertIn(f'http://{host}/api/v1/report/drivers/'.encode(), body)
+        self.assertEqual(len(self.asgi_app._links), snapshots.MAX_URL_ROOTS)
+        self.assertNotIn('http://host0.example', self.asgi_app._links)
+
+    def test_sessions_cached(self):
+        with patch('report_racers.get_sessions', wraps=report_racers.get_sessions) as get_sessions:
+            for _ in range(3):
+                self.assertEqual(call_asgi(self.asgi_app, '/api/v1/report/', 'session=3')[0], 404)
+                self.assertEqual(call_asgi(self.asgi_app, '/api/v1/sessions/')[0], 200)
+        self.assertLessEqual(get_sessions.call_count, 2)
+
+
+class TestDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = str(self.folder / 'racers.db')
+
+    def test_sqlite_pragmas(self):
+        pragmas = db.sqlite_pragmas({'RACERS_DB_JOURNAL_MODE': 'delete'})
+        self.assertEqual(pragmas['journal_mode'], 'delete')
+        self.assertEqual(pragmas['synchronous'], db.DEFAULT_PRAGMAS['synchronous'])
+        database = db.make_database(self.path)
+        self.addCleanup(database.close)
+        self.assertEqual(database.execute_sql('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_read_only_database(self):
+        writer = db.make_database(self.path)
+        writer.bind(MODELS, bind_refs=False, bind_backrefs=False)
+        writer.create_tables(MODELS)
+        DriverModel.create(code='DR1', name='Driver One', team='Team A')
+        writer.close()
+        reader = db.make_database(self.path, read_only=True)
+        reader.bind(MODELS, bind_refs=False, bind_backrefs=False)
+        self.addCleanup(test_db.bind, MODELS, bind_refs=False, bind_backrefs=False)
+        self.addCleanup(reader.close)
+        self.assertEqual(DriverModel.get().code, 'DR1')
+        with self.assertRaises(OperationalError):
+            DriverModel.create(code='DR2', name='Driver Two', team='Team B')
+
+    def test_request_connection_closed(self):
+        database = db.make_database(self.path)
+        database.bind(MODELS, bind_refs=False, bind_backrefs=False)
+        self.addCleanup(test_db.bind, MODELS, bind_refs=False, bind_backrefs=False)
+        database.create_tables(MODELS)
+        database.close()
+        self.assertEqual(app.test_client().get('/api/v1/sessions/').status_code, 200)
+        self.assertTrue(database.is_closed())
+
+    def test_pooled_sqlite_url(self):
+        database = db.database_from_url(f'sqlite+pool:///{self.path}?max_connections=4')
+        self.assertIsInstance(database, PooledSqliteDatabase)
+        self.assertEqual(database._pragmas, list(db.sqlite_pragmas().items()))
+        database.bind(MODELS, bind_refs=False, bind_backrefs=False)
+        self.addCleanup(test_db.bind, MODELS, bind_refs=False, bind_backrefs=False)
+        self.addCleanup(database.close_all)
+        self.assertIs(db.get_database(), database)
+        database.create_tables(MODELS)
+        self.assertTrue(report_racers.import_data())
+        expected = report_racers.get_all_racer('asc')
+        self.assertEqual(len(expected), 19)
+        database.close()
+        self.assertEqual(app.test_client().get('/api/v1/report/').get_json(), expected)
+        self.assertEqual(len(database._in_use), 0)
+        # Соединение из пула, открытое в одном потоке, переходит к запросам других потоков
+        responses = []
+        for _ in range(2):
+            thread = threading.Thread(target=lambda: responses.append(
+                app.test_client().get('/api/v1/report/').get_json()))
+            thread.start()
+            thread.join()
+        self.assertEqual(responses, [expected, expected])
+        self.assertEqual(len(database._connections), 1)
+
+    def test_postgres_duration_sql(self):
+        postgres = PostgresqlDatabase('racers')
+        postgres.bind(MODELS, bind_refs=False, bind_backrefs=False)
+        self.addCleanup(test_db.bind, MODELS, bind_refs=False, bind_backrefs=False)
+        self.assertTrue(db.is_postgres())
+        sql, _ = report_racers._durations().sql()
+        self.assertIn('EXTRACT(EPOCH FROM MAX("t2"."datetime"))', sql)
+        sql, _ = DriverModel.select(report_racers._format_duration(DriverModel.id)).sql()
+        self.assertIn("CAST((INTERVAL '1 microsecond' * \"t1\".\"id\") AS TIME)", sql)
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        # База данных в старом формате: без индексов и с дубликатами
+        self.legacy_db = SqliteDatabase(':memory:')
+        self.legacy_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+        self.legacy_db.connect()
+        for sql in (
+            'CREATE TABLE "drivermodel" ("id" INTEGER NOT NULL PRIMARY KEY, '
+            '"code" TEXT NOT NULL, "name" TEXT NOT NULL, "team" TEXT NOT NULL, '
+            '"result_time" TIME)',
+            'CREATE TABLE "startlogmodel" ("id" INTEGER NOT NULL PRIMARY KEY, '
+            '"datetime" DATETIME NOT NULL, "driver_id" INTEGER NOT NULL)',
+            'CREATE TABLE "endlogmodel" ("id" INTEGER NOT NULL PRIMARY KEY, '
+            '"datetime" DATETIME NOT NULL, "driver_id" INTEGER NOT NULL)',
+            "INSERT INTO drivermodel (code, name, team) VALUES "
+            "('DR1', 'Driver One', 'Team A'), ('DR1', 'Driver One', 'Team A')",
+            "INSERT INTO startlogmodel (datetime, driver_id) VALUES "
+            "('2023-01-01 12:00:00', 1), ('2023-01-01 12:00:00', 2)",
+            "INSERT INTO endlogmodel (datetime, driver_id) VALUES "
+            "('2023-01-01 12:01:00', 2)",
+        ):
+            self.legacy_db.execute_sql(sql)
+
+    def tearDown(self):
+        self.legacy_db.close()
+
+    def test_migrate_database(self):
+        self.assertEqual(migrations.migrate_database(), migrations.SCHEMA_VERSION)
+
+        self.assertEqual(DriverModel.select().count(), 1)
+        self.assertEqual(StartLogModel.select().count(), 1)
+        self.assertEqual(EndLogModel.get().driver_id, DriverModel.get().id)
+        indexes = {index.name: index.unique
+                   for index in self.legacy_db.get_indexes('drivermodel')}
+        self.assertTrue(indexes['drivermodel_code'])
+        self.assertIn('drivermodel_result_time', indexes)
+        self.assertTrue(
+            {'startlogmodel_driver_id_datetime_no_session',
+             'startlogmodel_session_id_driver_id_datetime'}.issubset(
+                index.name for index in self.legacy_db.get_indexes('startlogmodel')))
+        # Повторный запуск ничего не меняет
+        self.assertEqual(migrations.migrate_database(), migrations.SCHEMA_VERSION)
+
 
 class TestMonacoFileFlask(unittest.TestCase):
 
@@ -120,16 +795,15 @@ class TestMonacoFileFlask(unittest.TestCase):
         cls.client = app.test_client()
         with app.app_context():
             # Создание всех таблиц
-            test_db.bind([DriverModel, StartLogModel, EndLogModel],
-                         bind_refs=False, bind_backrefs=False)
+            test_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
             test_db.connect()
-            test_db.create_tables([DriverModel, StartLogModel, EndLogModel])
+            test_db.create_tables(MODELS)
 
     @classmethod
     def tearDownClass(cls):
         try:
             # Удаление всех таблиц
-            test_db.drop_tables([DriverModel, StartLogModel, EndLogModel])
+            test_db.drop_tables(MODELS)
         except Exception as e:
             print(f"Error dropping tables: {e}")
         finally:
@@ -157,9 +831,67 @@ class TestMonacoFileFlask(unittest.TestCase):
     def tearDown(self):
         with app.app_context():
             # Очистка таблиц после каждого теста
+            ResultModel.delete().execute()
+            SessionDriverModel.delete().execute()
+            StandingModel.delete().execute()
+            CrossingModel.delete().execute()
             DriverModel.delete().execute()
             StartLogModel.delete().execute()
             EndLogModel.delete().execute()
+            SessionModel.delete().execute()
+            MetaModel.delete().execute()
+            report_cache.cache.clear()
+            snapshots.store.clear()
+            live.clear_feeds()
+
+    def test_create_app(self):
+        with patch('report_racers.store_data_from_files_to_db') as store_mock:
+            new_app = create_app({'TESTING': True})
+        store_mock.assert_not_called()
+        self.assertTrue(new_app.config['TESTING'])
+        self.assertIn('racers', new_app.cli.commands)
+        report_racers.result_update()
+        response = new_app.test_client().get('/api/v1/report/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_report_cache_generation(self):
+        report_racers.result_update()
+        self.assertEqual(
+            self.client.get('/api/v1/report/').json[0]['name'], 'Driver One')
+        DriverModel.update(name='Renamed').where(DriverModel.code == 'DR1').execute()
+        report_racers.rebuild_standings()
+        # Пока поколение данных не изменилось, ответ берется из кэша
+        self.assertEqual(
+            self.client.get('/api/v1/report/').json[0]['name'], 'Driver One')
+        report_racers.bump_generation()
+        self.assertEqual(
+            self.client.get('/api/v1/report/').json[0]['name'], 'Renamed')
+        response = self.client.get('/report')
+        self.assertIn(b'Renamed', response.data)
+
+    def test_snapshot_etag(self):
+        report_racers.result_update()
+        response = self.client.get('/api/v1/report/?format=xml')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        response = self.client.get('/api/v1/report/?format=xml',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        # После обновления результатов тело и ETag пересобираются
+        EndLogModel.update(datetime=datetime(2023, 1, 1, 12, 3, 0)).where(
+            EndLogModel.datetime == datetime(2023, 1, 1, 12, 2, 0)).execute()
+        report_racers.result_update()
+        response = self.client.get('/api/v1/report/?format=xml',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'00:03:00.000000', response.data)
+
+    def test_invalid_order_api(self):
+        report_racers.result_update()
+        response = self.client.get('/api/v1/report/?order=up')
+        self.assertEqual(response.status_code, 400)
 
     def test_read_file(self):
         with patch("builtins.open", new_callable=mock_open, read_data="line1\nline2\nline3") as mock_file_open:
@@ -193,6 +925,13 @@ class TestMonacoFileFlask(unittest.TestCase):
         self.assertIn(b'Comand data : Team A', response.data)
         self.assertIn(b'Time : 00:01:00.000000', response.data)
 
+    def test_name_page_not_found(self):
+        report_racers.result_update()
+        response = self.client.get('/report/drivers/XXX')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/api/v1/report/drivers/XXX/')
+        self.assertEqual(response.status_code, 404)
+
     def test_index_api(self):
         report_racers.result_update()
         response = self.client.get('/api/v1/report/')
@@ -244,6 +983,79 @@ class TestMonacoFileFlask(unittest.TestCase):
             self.assertIsNotNone(team_element)
             self.assertEqual(team_element.text, expected_data[index]['team'])
 
+    def test_index_api_xml_stream(self):
+        DriverModel.update(name='Driver <One> & Co').where(
+            DriverModel.code == 'DR1').execute()
+        report_racers.result_update()
+        response = self.client.get('/api/v1/report/?format=xml&stream=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'text/xml')
+        streamed = etree.fromstring(response.data)
+        expected = etree.fromstring(
+            self.client.get('/api/v1/report/?format=xml').data)
+        self.assertEqual(etree.tostring(streamed), etree.tostring(expected))
+        self.assertEqual(streamed.find('driver/data/name').text, 'Driver <One> & Co')
+
+    def test_info_driver_api_xml_stream(self):
+        report_racers.result_update()
+        response = self.client.get('/api/v1/report/drivers/?format=xml&stream=1')
+        self.assertTrue(response.is_streamed)
+        root = etree.fromstring(response.data)
+        self.assertEqual(
+            [code.text for code in root.findall('driver/data/code')],
+            ['http://localhost/api/v1/report/drivers/DR1/',
+             'http://localhost/api/v1/report/drivers/DR2/'])
+
+    def test_index_api_json_stream(self):
+        report_racers.result_update()
+        response = self.client.get('/api/v1/report/?stream=1')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.json, self.client.get('/api/v1/report/').json)
+
+    def test_index_api_ndjson(self):
+        report_racers.result_update()
+        response = self.client.get('/api/v1/report/?format=ndjson&order=desc')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.data.decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['code'] for line in lines], ['DR2', 'DR1'])
+        response = self.client.get('/api/v1/report/drivers/?format=ndjson')
+        self.assertIn('/api/v1/report/drivers/DR1/',
+                      json.loads(response.data.decode('utf-8').splitlines()[0])['code'])
+
+    def test_index_api_pages(self):
+        driver3 = DriverModel.create(code='DR3', name='Driver Three', team='Team C')
+        StartLogModel.create(driver=driver3, datetime=datetime(2023, 1, 1, 12, 0, 0))
+        EndLogModel.create(driver=driver3, datetime=datetime(2023, 1, 1, 12, 1, 0))
+        report_racers.result_update()
+        codes = []
+        url = '/api/v1/report/?limit=1'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            codes.extend(racer['code'] for racer in response.json)
+            link = response.headers.get('Link')
+            url = link[1:link.index('>')] if link else None
+        # Одинаковое время DR1 и DR3 упорядочено по id
+        self.assertEqual(codes, ['DR1', 'DR3', 'DR2'])
+
+        response = self.client.get('/api/v1/report/?order=desc&limit=2')
+        self.assertEqual([racer['code'] for racer in response.json], ['DR2', 'DR3'])
+        cursor = response.headers['Link'].split('after=')[1].split('>')[0]
+        response = self.client.get(
+            f'/api/v1/report/drivers/?order=desc&limit=2&after={cursor}')
+        self.assertEqual(len(response.json), 1)
+        self.assertIn('/api/v1/report/drivers/DR1/', response.json[0]['code'])
+        self.assertNotIn('Link', response.headers)
+
+    def test_index_api_pages_invalid(self):
+        report_racers.result_update()
+        self.assertEqual(
+            self.client.get('/api/v1/report/?limit=0').status_code, 400)
+        self.assertEqual(
+            self.client.get('/api/v1/report/?after=abc').status_code, 400)
+
     def test_info_driver_api(self):
         report_racers.result_update()
         response = self.client.get('/api/v1/report/drivers/')
@@ -251,6 +1063,18 @@ class TestMonacoFileFlask(unittest.TestCase):
         self.assertIn('/api/v1/report/drivers/DR1/', response.json[0]['code'])
         self.assertIn('/api/v1/report/drivers/DR2/', response.json[1]['code'])
 
+    def test_snapshots_bounded_per_host(self):
+        report_racers.result_update()
+        report_body = self.client.get('/api/v1/report/').data
+        for number in range(snapshots.MAX_URL_ROOTS + 5):
+            host = f'host{number}.example'
+            response = self.client.get('/api/v1/report/drivers/', headers={'Host': host})
+            self.assertIn(f'http://{host}/api/v1/report/drivers/DR1/', response.json[0]['code'])
+            self.assertEqual(self.client.get('/api/v1/report/', headers={'Host': host}).data,
+                             report_body)
+        self.assertEqual(len(snapshots.store._links), snapshots.MAX_URL_ROOTS)
+        self.assertNotIn('http://host0.example/', snapshots.store._links)
+
     def test_info_driver_api_xml(self):
         expected_data = [{'time': '00:01:00.000000',
                           'code': 'http://localhost/api/v1/report/drivers/DR1/',
@@ -298,6 +1122,33 @@ class TestMonacoFileFlask(unittest.TestCase):
                            'team': 'Team A',
                            'result_time': '00:01:00.000000'}])
 
+    def test_laps_api(self):
+        report_racers.result_update()
+        response = self.client.get('/api/v1/report/drivers/DR2/laps/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {
+            'code': 'DR2', 'name': 'Driver Two', 'team': 'Team B',
+            'best_lap': '00:02:00.000000',
+            'laps': [{'lap': 1, 'lap_time': '00:02:00.000000', 'elapsed': '00:02:00.000000',
+                      'gap': '00:01:00.000000', 'position': 2, 'best': True}]})
+        self.assertEqual(self.client.get('/api/v1/report/drivers/XXX/laps/').status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/report/drivers/DR1/laps/?session=4').status_code,
+                         404)
+
+    def test_teams_api(self):
+        report_racers.result_update()
+        response = self.client.get('/api/v1/report/teams/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, [
+            {'team': 'Team A', 'drivers': 1, 'best_time': '00:01:00.000000',
+             'average_time': '00:01:00.000000', 'total_time': '00:01:00.000000'},
+            {'team': 'Team B', 'drivers': 1, 'best_time': '00:02:00.000000',
+             'average_time': '00:02:00.000000', 'total_time': '00:02:00.000000'}])
+        response = self.client.get('/api/v1/report/teams/Team%20B/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([racer['code'] for racer in response.json['racers']], ['DR2'])
+        self.assertEqual(self.client.get('/api/v1/report/teams/Team%20C/').status_code, 404)
+
     def test_name_page_api_xml(self):
         report_racers.result_update()
         response = self.client.get('/api/v1/report/drivers/DR1/?format=xml')
@@ -326,6 +1177,86 @@ class TestMonacoFileFlask(unittest.TestCase):
         self.assertIsNotNone(team_element)
         self.assertEqual(team_element.text, 'Team A')
 
+    def test_session_api(self):
+        root = make_sessions_dir()
+        self.addCleanup(shutil.rmtree, root)
+        with app.app_context():
+            report_racers.store_sessions_from_dir(root)
+        sessions = self.client.get('/api/v1/sessions/').get_json()
+        self.assertEqual([item['name'] for item in sessions], ['qualifying', 'race'])
+        qualifying = sessions[0]['id']
+        response = self.client.get(f'/api/v1/report/drivers/SVF/?session={qualifying}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()[0]['result_time'], '00:02:04.415000')
+        self.assertIn('ETag', response.headers)
+        response = self.client.get(f'/api/v1/report/drivers/?session={qualifying}&limit=2')
+        self.assertIn(f'session={qualifying}', response.headers['Link'])
+        self.assertIn(f'session={qualifying}', response.get_json()[0]['code'])
+        # Сессия не влияет на отчет по данным из папки data
+        self.assertEqual(self.client.get('/api/v1/report/drivers/SVF/').status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/report/?session=x').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/report/?session=999').status_code, 404)
+
+    def test_live_feed_deltas(self):
+        report_racers.result_update()
+        feed = live.StandingsFeed(interval=0)
+        events = feed.subscribe(heartbeat=60)
+        first = next(events)
+        self.assertTrue(first.startswith('id: 1\nevent: standings\n'))
+        standings = json.loads(first.split('data: ', 1)[1])
+        self.assertEqual([(entry['code'], entry['position']) for entry in standings],
+                         [('DR1', 1), ('DR2', 2)])
+        EndLogModel.create(driver=DriverModel.get(code='DR1'),
+                           datetime=datetime(2023, 1, 1, 12, 3, 0))
+        report_racers.result_update()
+        message = next(events)
+        self.assertTrue(message.startswith('id: 2\nevent: delta\n'))
+        self.assertEqual(json.loads(message.split('data: ', 1)[1]), [
+            {'code': 'DR2', 'result_time': '00:02:00.000000', 'position': 1},
+            {'code': 'DR1', 'result_time': '00:03:00.000000', 'position': 2}])
+        # Переподключение с Last-Event-ID получает только пропущенные изменения
+        self.assertTrue(next(feed.subscribe('1', heartbeat=60)).startswith('id: 2\nevent: delta'))
+        self.assertIn('event: standings', next(feed.subscribe('7', heartbeat=60)))
+        events.close()
+
+    def test_live_stream_endpoint(self):
+        report_racers.result_update()
+        response = self.client.get('/api/v1/report/stream', buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertIn(b'event: standings', next(iter(response.response)))
+        response.close()
+        self.assertEqual(self.client.get('/api/v1/report/stream?session=5').status_code, 404)
+
+    def test_metrics_endpoint(self):
+        report_racers.result_update()
+        metrics.registry.reset()
+        self.client.get('/api/v1/report/?format=json')
+        self.client.get('/api/v1/report/?format=json')
+        self.client.get('/api/v1/report/drivers/DR1/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/plain')
+        text = response.get_data(as_text=True)
+        self.assertIn('racers_http_requests_total{method="GET",route="/api/v1/report/",status="200"} 2',
+                      text)
+        self.assertIn('route="/api/v1/report/drivers/<name>/"', text)
+        self.assertIn('racers_http_request_duration_seconds_bucket{method="GET",'
+                      'route="/api/v1/report/",le="+Inf"} 2', text)
+        self.assertIn('racers_sql_duration_seconds_count{route="/api/v1/report/",statement="SELECT"}',
+                      text)
+        self.assertIn('racers_cache_requests_total{cache="snapshot",result="hit"} 2', text)
+        self.assertIn('racers_cache_hit_ratio{cache="report"}', text)
+
+    def test_slow_query_log(self):
+        self.addCleanup(setattr, metrics.registry, 'slow_query_seconds', None)
+        client = create_app({'TESTING': True, 'SLOW_QUERY_MS': 0}).test_client()
+        with self.assertLogs('racers.slow_query', level='WARNING') as logs:
+            client.get('/api/v1/sessions/')
+        output = '\n'.join(logs.output)
+        self.assertIn('report_racers.get_sessions', output)
+        self.assertIn('(route /api/v1/sessions/): SELECT', output)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,59 @@
+import re
+from datetime import datetime
+
+# Формат '%Y-%m-%d_%H:%M:%S.%f': поля на фиксированных позициях, от 1 до 6 цифр дробной части
+_LOG_DATETIME = re.compile(r'\d{4}-\d\d-\d\d_\d\d:\d\d:\d\d\.\d{1,6}', re.ASCII).fullmatch
+
+
+def parse_datetime(text):
+    """
+    Parse a log timestamp in the '%Y-%m-%d_%H:%M:%S.%f' format.
+
+    The layout is checked with one precompiled regular expression, then the text is
+    converted by datetime.fromisoformat (written in C, it accepts any character
+    between the date and the time) instead of datetime.strptime, which is several
+    times slower. Fractions that fromisoformat does not take before Python 3.11
+    (other than 3 or 6 digits) are converted from the fixed-position slices. For
+    well-formed log timestamps the result is the same as with strptime, but the
+    parser is stricter: every field must have its full width, so text strptime
+    accepts, e.g. '2018-5-24_1:2:3.9', raises ValueError here.
+
+    Args:
+        text (str): The timestamp, e.g. '2018-05-24_12:02:58.917'.
+
+    Returns:
+        datetime: The parsed timestamp.
+
+    Raises:
+        ValueError: If the text does not match the format or is not a valid date.
+    """
+    if _LOG_DATETIME(text) is None:
+        raise ValueError(f"time data {text!r} does not match the log format")
+    fraction = text[20:]
+    if len(fraction) in (3, 6):
+        return datetime.fromisoformat(text)
+    return datetime(int(text[:4]), int(text[5:7]), int(text[8:10]),
+                    int(text[11:13]), int(text[14:16]), int(text[17:19]),
+                    int(fraction) * 10 ** (6 - len(fraction)))
+
+
+def parse_log_lines(lines):
+    """
+    Parse start/end log lines into (code, datetime) records.
+
+    Args:
+        lines (list): Lines in the '<code><timestamp>' format, see parse_datetime.
+
+    Returns:
+        list: A list of (code, datetime) tuples in file order.
+
+    Raises:
+        ValueError: If a timestamp is invalid; the message contains the line number.
+    """
+    records = []
+    for number, line in enumerate(lines, 1):
+        try:
+            records.append((line[:3], parse_datetime(line[3:])))
+        except ValueError as e:
+            raise ValueError(f"line {number}: {e}") from None
+    return records